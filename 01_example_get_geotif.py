@@ -2,8 +2,9 @@ import os
 import ee
 import json
 import numpy as np
-import requests
 import geopandas as gpd
+from http_download import download_to_file, STATS
+from collection_metadata import get_scale
 
 ################################################################################################
 
@@ -37,7 +38,7 @@ image = image.sum()
 image = image.clip(REGION)
 image = image.mask(image.mask())
 
-SCALE = ee.ImageCollection(SATELLITE).first().projection().nominalScale().getInfo()
+SCALE = get_scale(SATELLITE, BANDS)
 
 url = image.getDownloadUrl({
     'bands': BANDS,
@@ -47,11 +48,9 @@ url = image.getDownloadUrl({
     'format': 'GEO_TIFF'
 })
 
-response = requests.get(url)
-
-with open("myImage_INDIA_clipped.tif", 'wb') as fd:
-    fd.write(response.content)
+download_to_file(url, "myImage_INDIA_clipped.tif")
 
+print(STATS.summary())
 print("done")
 
 
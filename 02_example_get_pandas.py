@@ -4,6 +4,7 @@ import json
 import numpy as np
 import geopandas as gpd
 import pandas as pd
+from collection_metadata import get_scale
 
 ################################################################################################
 
@@ -42,7 +43,7 @@ SATELLITE = "ECMWF/ERA5_LAND/MONTHLY_AGGR"
 
 BANDS = ["total_precipitation_sum"]
 
-SCALE = ee.ImageCollection(SATELLITE).first().projection().nominalScale().getInfo()
+SCALE = get_scale(SATELLITE, BANDS)
 
 dataset = ee.ImageCollection(SATELLITE).select(BANDS)
 
@@ -67,7 +68,7 @@ def a(i):
     statsL = temporalStat.reduceRegions(
         collection=area,
         reducer=spatialReducers,
-        scale=dataset.first().projection().nominalScale().getInfo(),
+        scale=SCALE,
         crs=dataset.first().projection()
     )
 
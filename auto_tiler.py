@@ -0,0 +1,108 @@
+import math
+import os
+import shutil
+import tempfile
+import ee
+from osgeo import gdal
+from shapely.geometry import box, shape
+from shapely.prepared import prep
+from tile_downloader import TileDownloader
+from tracing import file_size, span
+
+
+# getDownloadUrl refuses requests above ~48 MB or 10000 px per side, stay below both
+MAX_REQUEST_BYTES = 32 * 1024 * 1024
+MAX_GRID_DIMENSION = 10000
+METERS_PER_DEGREE = 111319.49
+
+
+def scale_to_degrees(scale):
+    return scale / METERS_PER_DEGREE
+
+
+def estimate_request_bytes(bounds, scale_deg, n_bands, bytes_per_pixel):
+    minx, miny, maxx, maxy = bounds
+    width = math.ceil((maxx - minx) / scale_deg)
+    height = math.ceil((maxy - miny) / scale_deg)
+    return width, height, width * height * n_bands * bytes_per_pixel
+
+
+def plan_tiles(bounds, geometry, scale_deg, n_bands=1, bytes_per_pixel=4,
+               max_bytes=MAX_REQUEST_BYTES, max_dim=MAX_GRID_DIMENSION):
+    # quadtree split only the cells that are too large, drop the ones outside the geometry
+    prepared = prep(geometry) if geometry is not None else None
+    tiles = []
+    stack = [tuple(bounds)]
+    while stack:
+        cell = stack.pop()
+        if prepared is not None and not prepared.intersects(box(*cell)):
+            continue
+        width, height, size = estimate_request_bytes(cell, scale_deg, n_bands, bytes_per_pixel)
+        if size <= max_bytes and width <= max_dim and height <= max_dim:
+            tiles.append(cell)
+            continue
+        minx, miny, maxx, maxy = cell
+        midx = (minx + maxx) / 2
+        midy = (miny + maxy) / 2
+        stack.extend([
+            (minx, midy, midx, maxy),
+            (midx, midy, maxx, maxy),
+            (minx, miny, midx, midy),
+            (midx, miny, maxx, midy),
+        ])
+    return tiles
+
+
+def region_to_shapely(region):
+    # one getInfo round trip when only the ee.FeatureCollection is at hand
+    with span("getInfo"):
+        return shape(region.geometry().getInfo())
+
+
+def mosaic_tiles(tile_files, out_file):
+    vrt_file = f"{out_file}.vrt"
+    gdal.BuildVRT(vrt_file, tile_files)
+    gdal.Translate(out_file, vrt_file, creationOptions=['COMPRESS=LZW', 'TILED=YES', 'BIGTIFF=IF_SAFER'])
+    os.remove(vrt_file)
+
+
+def download_tiled(image, bands, scale, geometry, out_file, bytes_per_pixel=4,
+                   max_bytes=MAX_REQUEST_BYTES, max_workers=8, downloader=None):
+    tiles = plan_tiles(geometry.bounds, geometry, scale_to_degrees(scale), len(bands),
+                       bytes_per_pixel, max_bytes)
+    if not tiles:
+        # nothing to mosaic, gdal.BuildVRT would return None
+        raise ValueError(f"no tiles intersect the region of {out_file}")
+
+    downloader = downloader or TileDownloader(max_workers=max_workers)
+
+    def fetch(job):
+        tile_file, bounds = job
+        with span("getDownloadUrl"):
+            path = image.getDownloadUrl({
+                'bands': bands,
+                'scale': scale,
+                'crs': "EPSG:4326",
+                'region': ee.Geometry.BBox(*bounds),
+                'format': 'GEO_TIFF'
+            })
+        downloader.download(path, tile_file)
+        return tile_file
+
+    # tiles per output are the getDownloadUrl count over the download_tiled count
+    with span("download_tiled") as trace:
+        if len(tiles) == 1:
+            fetch((out_file, tiles[0]))
+        else:
+            tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_file)))
+            try:
+                jobs = [(f"{tmp_dir}/tile_{i}.tif", bounds) for i, bounds in enumerate(tiles)]
+                tile_files = downloader.map(fetch, jobs)
+                if len(tile_files) != len(jobs):
+                    raise RuntimeError(f"{len(jobs) - len(tile_files)} tiles failed for {out_file}")
+                mosaic_tiles(sorted(tile_files), out_file)
+            finally:
+                shutil.rmtree(tmp_dir)
+        trace["bytes"] = file_size(out_file)
+
+    return tiles
@@ -0,0 +1,375 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from osgeo import gdal, osr
+
+
+# synthetic inputs at ~1 km (30 arc-seconds), integer bounds so the 5 degree tiles line up
+RESOLUTION = 1 / 120
+SIZES = {
+    "country": {"bounds": (6, 36, 19, 47), "regions": 20},
+    "continent": {"bounds": (-25, 34, 45, 72), "regions": 700},
+    "global": {"bounds": (-180, -90, 180, 90), "regions": 3600},
+}
+PANEL_INTERVALS = 240  # 20 years of monthly composites
+MAX_IN_MEMORY_PIXELS = 20 * 1000 * 1000  # the in-memory XYZ export is only run below this
+VIIRS = "NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG"
+HISTORY_FILE = "benchmark_history.json"
+WORK_DIR = "bench_data"
+
+
+def synthetic_raster(path, bounds, resolution=RESOLUTION, sparse=False, block_rows=512):
+    # smooth field plus noise, with nodata "sea"; written strip by strip so the global size fits in memory
+    minx, miny, maxx, maxy = bounds
+    width = int(round((maxx - minx) / resolution))
+    height = int(round((maxy - miny) / resolution))
+    tmp_path = f"{path}.{os.getpid()}.tmp.tif"
+    ds = gdal.GetDriverByName("GTiff").Create(tmp_path, width, height, 1, gdal.GDT_UInt16,
+                                              ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER', 'SPARSE_OK=TRUE'])
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetGeoTransform((minx, resolution, 0, maxy, 0, -resolution))
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(0)
+
+    if not sparse:
+        rng = np.random.default_rng(0)
+        lon = minx + (np.arange(width) + 0.5) * resolution
+        for row in range(0, height, block_rows):
+            rows = min(block_rows, height - row)
+            lat = maxy - (row + np.arange(rows) + 0.5) * resolution
+            field = np.cos(np.radians(3 * lat))[:, None] * np.sin(np.radians(3 * lon))[None, :]
+            values = (field + 1) * 20000 + rng.integers(0, 5000, (rows, width))
+            values[field < -0.3] = 0
+            band.WriteArray(values.astype(np.uint16), 0, row)
+    ds = None
+    os.replace(tmp_path, path)
+
+
+def make_inputs(size, work_dir):
+    # cached between runs, the global raster takes a while to generate
+    input_dir = f"{work_dir}/inputs"
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir)
+    raster = f"{input_dir}/{size}.tif"
+    match = f"{input_dir}/{size}_match.tif"
+    if not os.path.exists(raster):
+        print(f"generating {raster}")
+        synthetic_raster(raster, SIZES[size]["bounds"])
+    if not os.path.exists(match):
+        # only the grid of the match file is used, its blocks stay sparse
+        synthetic_raster(match, SIZES[size]["bounds"], resolution=0.01, sparse=True)
+    return {"raster": raster, "match": match}
+
+
+def panel_rows(n_regions, n_intervals=PANEL_INTERVALS):
+    rng = np.random.default_rng(0)
+    stats = rng.random((n_intervals, n_regions, 4))
+    rows = []
+    for t in range(n_intervals):
+        composite_start = f"{2000 + t // 12}{t % 12 + 1:02d}"
+        for j in range(n_regions):
+            mean, std, variance, total = stats[t, j].tolist()
+            rows.append({"GID_0": "XXX", "NAME_0": "Country", "GID_1": f"XXX.{j + 1}_1", "NAME_1": f"Region {j + 1}",
+                         "mean": mean, "stdDev": std, "variance": variance, "sum": total,
+                         "composite_start": composite_start, "interval_offset": t})
+    return rows
+
+
+def checked(fn, *args, **kwargs):
+    # the warp helpers print their errors and return None instead of raising
+    if not fn(*args, **kwargs):
+        raise RuntimeError(f"{fn.__name__} failed")
+
+
+# a stage prepares its inputs and returns the callable that is timed, or None to skip the size
+def stage_xyz(inputs, size, out_dir, options):
+    from raster_io import geotiff_to_xyz
+    ds = gdal.Open(inputs["raster"], gdal.GA_ReadOnly)
+    if ds.RasterXSize * ds.RasterYSize > MAX_IN_MEMORY_PIXELS:
+        return None
+    return lambda: checked(geotiff_to_xyz, inputs["raster"], f"{out_dir}/xyz.parquet.gzip")
+
+
+def stage_xyz_stream(inputs, size, out_dir, options):
+    from raster_io import geotiff_to_xyz
+    return lambda: checked(geotiff_to_xyz, inputs["raster"], f"{out_dir}/xyz.parquet.gzip", stream=True)
+
+
+def stage_warp_to_resolution(inputs, size, out_dir, options):
+    from nigthlight import warp_to_resolution
+    return lambda: checked(warp_to_resolution, inputs["raster"], f"{out_dir}/warped.tif", 2 * RESOLUTION)
+
+
+def stage_warp_to_resolution_parallel(inputs, size, out_dir, options):
+    from nigthlight import warp_to_resolution
+    return lambda: checked(warp_to_resolution, inputs["raster"], f"{out_dir}/warped.tif", 2 * RESOLUTION,
+                           parallel=True)
+
+
+def stage_warp_and_match_resolution(inputs, size, out_dir, options):
+    from nigthlight import warp_and_match_resolution
+    return lambda: checked(warp_and_match_resolution, inputs["raster"], f"{out_dir}/matched.tif", inputs["match"])
+
+
+def pad_dict_list(dict_list, padel):
+    # the column-wise payload the panel used to be built from, kept as the baseline stage
+    lmax = 0
+    for lname in dict_list.keys():
+        lmax = max(lmax, len(dict_list[lname]))
+    for lname in dict_list.keys():
+        ll = len(dict_list[lname])
+        if ll < lmax:
+            dict_list[lname] += [padel] * (lmax - ll)
+    return dict_list
+
+
+def stage_panel_pad_dict_list(inputs, size, out_dir, options):
+    # the fc_to_dict payload: one list per property
+    import pandas as pd
+    rows = panel_rows(SIZES[size]["regions"])
+    output = {key: [row[key] for row in rows] for key in rows[0]}
+    output["system:index"] = [str(i) for i in range(len(rows))]
+    return lambda: pd.DataFrame(pad_dict_list(output, np.nan))
+
+
+def stage_panel_features(inputs, size, out_dir, options):
+    # the feature payload of ZsGEE.fetch_dataframe
+    from get_gee_PANELDATA import features_to_frame
+    rows = panel_rows(SIZES[size]["regions"])
+    info = {"features": [{"id": str(i), "properties": row} for i, row in enumerate(rows)]}
+    return lambda: features_to_frame(info)
+
+
+def stage_downlaodtiles(inputs, size, out_dir, options):
+    # tile fan-out against the local stand-in, one quarter over the size's bounds
+    import ee_backend
+    ee_backend.use_backend("mock")
+    import collection_metadata
+    import mock_ee
+    import nigthlight
+    collection_metadata.CACHE_DIR = f"{out_dir}/collections"
+    mock_ee.register_collection(VIIRS, bands=["avg_rad", "cf_cvg"], scale=1000, start="2012-01-01", end="2013-01-01")
+    mock_ee.configure(rpc_latency=options["rpc_latency"], http_latency=options["http_latency"])
+
+    def run():
+        nigthlight.downlaodtiles(f"{out_dir}/tiles", None, None, start_date="2012-01-01", end_date="2012-07-01",
+                                 bounds=SIZES[size]["bounds"], max_workers=options["max_workers"])
+        mock_ee.shutdown()
+    return run
+
+
+STAGES = {
+    "xyz": stage_xyz,
+    "xyz_stream": stage_xyz_stream,
+    "warp_to_resolution": stage_warp_to_resolution,
+    "warp_to_resolution_parallel": stage_warp_to_resolution_parallel,
+    "warp_and_match_resolution": stage_warp_and_match_resolution,
+    "panel_pad_dict_list": stage_panel_pad_dict_list,
+    "panel_features": stage_panel_features,
+    "downlaodtiles": stage_downlaodtiles,
+}
+
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def proc_status_kb(field):
+    with open("/proc/self/status") as fd:
+        for line in fd:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    return None
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+        return proc_status_kb("VmRSS")
+    except OSError:
+        return None
+
+
+def peak_rss_kb(baseline, setup_maxrss):
+    # peak RSS added while the stage ran, in kilobytes; without /proc only the
+    # growth of ru_maxrss can be seen, which misses peaks below the setup's peak
+    if baseline is not None:
+        return max(0, proc_status_kb("VmHWM") - baseline)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - setup_maxrss
+
+
+def run_stage(stage, size, work_dir, options):
+    # runs inside its own process; the inputs and the stage fixture are built before
+    # the peak RSS is reset, so only run() is measured
+    gdal.UseExceptions()
+    inputs = make_inputs(size, work_dir)
+    out_dir = tempfile.mkdtemp(prefix=f"{stage}_{size}_", dir=work_dir)
+    result = {"stage": stage, "size": size}
+    try:
+        run = STAGES[stage](inputs, size, out_dir, options)
+        if run is None:
+            result["status"] = "skipped"
+            return result
+        baseline = reset_peak_rss()
+        setup_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        run()
+        result["seconds"] = time.perf_counter() - start
+        # kilobytes on Linux
+        result["peak_rss_mb"] = peak_rss_kb(baseline, setup_maxrss) / 1024
+        result["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        result["bytes_written"] = dir_size(out_dir)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    finally:
+        if not options["keep_outputs"]:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return result
+
+
+def run_in_subprocess(stage, size, work_dir, options):
+    command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--sizes", size,
+               "--work-dir", work_dir, "--rpc-latency", str(options["rpc_latency"]),
+               "--http-latency", str(options["http_latency"]), "--max-workers", str(options["max_workers"])]
+    if options["keep_outputs"]:
+        command.append("--keep-outputs")
+    process = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = process.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {"stage": stage, "size": size, "status": "failed", "error": process.stderr.strip()[-2000:]}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def write_history(history, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump(history, fd, indent=1)
+    os.replace(tmp_path, path)
+
+
+def find_regressions(history, run, window=5, threshold=0.15):
+    # compare with the median of the last `window` runs of the same stage and size on this host
+    regressions = []
+    for result in run["results"]:
+        if result["status"] != "ok":
+            continue
+        past = [r for previous in history if previous["host"] == run["host"]
+                for r in previous["results"]
+                if r["stage"] == result["stage"] and r["size"] == result["size"] and r["status"] == "ok"][-window:]
+        if not past:
+            continue
+        for metric in ("seconds", "peak_rss_mb", "bytes_written"):
+            baseline = statistics.median(r[metric] for r in past)
+            if baseline and result[metric] > baseline * (1 + threshold):
+                regressions.append(f"{result['stage']} [{result['size']}] {metric}: "
+                                   f"{result[metric]:.2f} vs median {baseline:.2f} of {len(past)} runs")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':<30}{'size':<11}{'seconds':>10}{'peak MB':>10}{'written MB':>12}")
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['stage']:<30}{r['size']:<11}  {r['status']} {r.get('error', '')[:200]}")
+            continue
+        print(f"{r['stage']:<30}{r['size']:<11}{r['seconds']:>10.2f}{r['peak_rss_mb']:>10.0f}"
+              f"{r['bytes_written'] / 1e6:>12.1f}")
+
+
+def benchmark(stages=None, sizes=("country", "continent"), history_path=HISTORY_FILE, work_dir=WORK_DIR,
+              threshold=0.15, window=5, rpc_latency=0.05, http_latency=0.1, max_workers=16, keep_outputs=False):
+    options = {"rpc_latency": rpc_latency, "http_latency": http_latency, "max_workers": max_workers,
+               "keep_outputs": keep_outputs}
+    work_dir = os.path.abspath(work_dir)
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    results = []
+    for size in sizes:
+        make_inputs(size, work_dir)
+        for stage in stages or STAGES:
+            print(f"{stage} [{size}]")
+            results.append(run_in_subprocess(stage, size, work_dir, options))
+
+    history = read_history(history_path)
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": platform.node(),
+        "options": options,
+        "results": results,
+    }
+    regressions = find_regressions(history, run, window, threshold)
+    history.append(run)
+    write_history(history, history_path)
+
+    print_results(results)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return run, regressions
+
+
+if __name__ == "__main__":
+
+    # e.g. python benchmark.py --sizes country continent global --stages xyz_stream warp_to_resolution
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGES))
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["country", "continent"])
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--window", type=int, default=5)
+    parser.add_argument("--rpc-latency", type=float, default=0.05)
+    parser.add_argument("--http-latency", type=float, default=0.1)
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--keep-outputs", action="store_true")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        options = {"rpc_latency": args.rpc_latency, "http_latency": args.http_latency,
+                   "max_workers": args.max_workers, "keep_outputs": args.keep_outputs}
+        print(json.dumps(run_stage(args.run_stage, args.sizes[0], args.work_dir, options)))
+        sys.exit(0)
+
+    run, regressions = benchmark(args.stages, args.sizes, args.history, args.work_dir, args.threshold, args.window,
+                                 args.rpc_latency, args.http_latency, args.max_workers, args.keep_outputs)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -0,0 +1,106 @@
+import os
+from functools import lru_cache
+import geopandas as gpd
+from shapely.geometry import Point
+
+
+REFERENCE_DIR = os.environ.get("GADM_DIR", "reference_datasets/gadm_401_GID_1")
+INDEX_DIR = os.environ.get("GADM_INDEX_DIR", "reference_datasets/gadm_401_index")
+# simplification tolerances precomputed by build_boundary_index.py, 0 is the raw geometry
+TOLERANCES = (0, 0.01, 0.1)
+INDEX_COLUMNS = ["country", "minx", "miny", "maxx", "maxy"]
+
+
+def gadm_path(gid, base_dir=None):
+    return f"{base_dir or REFERENCE_DIR}/{gid[0:3]}.gpkg"
+
+
+def gid_column(gid):
+    # 'ITA' is a country, 'ITA.16_1' an admin-1 unit
+    return "GID_1" if "." in gid else "GID_0"
+
+
+def index_path(level, tolerance, index_dir=None):
+    return f"{index_dir or INDEX_DIR}/{level}_tol{tolerance or 0}"
+
+
+def has_index(level, tolerance, index_dir=None):
+    return (tolerance or 0) in TOLERANCES and os.path.exists(index_path(level, tolerance, index_dir))
+
+
+def bbox_filters(bbox):
+    minx, miny, maxx, maxy = bbox
+    return [("maxx", ">=", minx), ("minx", "<=", maxx), ("maxy", ">=", miny), ("miny", "<=", maxy)]
+
+
+def read_index(level, tolerance=None, countries=None, gid=None, bbox=None, index_dir=None):
+    # partition pruning on country plus row-group statistics on the bbox columns
+    filters = []
+    if countries is not None:
+        filters.append(("country", "in", list(countries)))
+    if gid is not None:
+        filters.append((gid_column(gid), "=", gid))
+    if bbox is not None:
+        filters.extend(bbox_filters(bbox))
+
+    area = gpd.read_parquet(index_path(level, tolerance, index_dir), filters=filters or None)
+    area = area.drop(columns=[c for c in INDEX_COLUMNS if c in area.columns])
+    # partitions are stored in bbox order, return them in GID order like the GeoPackage dissolve
+    return area.sort_values(level, kind="stable").reset_index(drop=True)
+
+
+def read_gadm(gid, bbox=None, base_dir=None):
+    # push the attribute filter down to the GeoPackage instead of loading the whole country
+    column = gid_column(gid)
+    where = None
+    if column == "GID_1":
+        where = "GID_1 = '{}'".format(gid.replace("'", "''"))
+    return gpd.read_file(gadm_path(gid, base_dir), where=where, bbox=bbox)
+
+
+@lru_cache(maxsize=64)
+def _load_boundaries(gid, level, tolerance, bbox, base_dir):
+    if base_dir is None and level is not None and has_index(level, tolerance):
+        if level == "GID_1" or gid_column(gid) == "GID_0":
+            return read_index(level, tolerance, countries=[gid[0:3]], gid=gid, bbox=bbox)
+
+    area = read_gadm(gid, bbox=bbox, base_dir=base_dir)
+    area = area.loc[area[gid_column(gid)] == gid]
+    if level is not None:
+        area = area.dissolve(level).reset_index()
+    if tolerance is not None:
+        area.geometry = area.simplify(tolerance)
+    return area
+
+
+def get_boundaries(gid, level=None, tolerance=None, bbox=None, base_dir=None):
+    # cached by (gid, level, tolerance); callers get a copy they are free to modify
+    if bbox is not None:
+        bbox = tuple(bbox)
+    return _load_boundaries(gid, level, tolerance, bbox, base_dir).copy()
+
+
+def get_boundaries_multi(gids, level, tolerance=None, bbox=None):
+    # several countries (or admin-1 units) in one read of the index
+    countries = sorted(set(gid[0:3] for gid in gids))
+    area = read_index(level, tolerance, countries=countries, bbox=bbox)
+    if level == "GID_0":
+        keep = area["GID_0"].isin(countries)
+    else:
+        keep = area["GID_0"].isin(gids) | area["GID_1"].isin(gids)
+    return area.loc[keep].reset_index(drop=True)
+
+
+def find_regions(lon, lat, level="GID_1", tolerance=None):
+    # point in polygon: the bbox filter narrows the candidates before the exact test
+    point = Point(lon, lat)
+    candidates = read_index(level, tolerance, bbox=(lon, lat, lon, lat))
+    return candidates.loc[candidates.contains(point)].reset_index(drop=True)
+
+
+def clear_cache():
+    _load_boundaries.cache_clear()
+
+
+def cache_info():
+    return _load_boundaries.cache_info()
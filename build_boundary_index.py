@@ -0,0 +1,60 @@
+import glob
+import os
+import shutil
+import geopandas as gpd
+from boundary_store import REFERENCE_DIR, INDEX_DIR, TOLERANCES, index_path
+
+
+def add_bbox_columns(area):
+    bounds = area.geometry.bounds
+    area["minx"] = bounds["minx"]
+    area["miny"] = bounds["miny"]
+    area["maxx"] = bounds["maxx"]
+    area["maxy"] = bounds["maxy"]
+    return area
+
+
+def write_partition(area, level, tolerance, country, index_dir):
+    # hive style partition per country, sorted so the bbox statistics of each row group stay tight
+    out_dir = f"{index_path(level, tolerance, index_dir)}/country={country}"
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    area = area.sort_values(["miny", "minx"]).reset_index(drop=True)
+    area.to_parquet(f"{out_dir}/part-0.parquet", compression="zstd", row_group_size=256)
+
+
+def build_country(gpkg, index_dir, tolerances=TOLERANCES):
+    country = os.path.basename(gpkg).replace(".gpkg", "")
+    area = gpd.read_file(gpkg)
+
+    # same schema as the dissolve in boundary_store's GeoPackage fallback, callers drop what they don't need
+    levels = {
+        "GID_0": area.dissolve("GID_0").reset_index(),
+        "GID_1": area.dissolve("GID_1").reset_index(),
+    }
+    for level, dissolved in levels.items():
+        for tolerance in tolerances:
+            out = dissolved.copy()
+            if tolerance:
+                out.geometry = out.simplify(tolerance)
+            write_partition(add_bbox_columns(out), level, tolerance, country, index_dir)
+
+    return country
+
+
+def build_index(reference_dir=REFERENCE_DIR, index_dir=INDEX_DIR, tolerances=TOLERANCES):
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+
+    countries = []
+    for gpkg in sorted(glob.glob(f"{reference_dir}/*.gpkg")):
+        countries.append(build_country(gpkg, index_dir, tolerances))
+        print(countries[-1])
+
+    return countries
+
+
+if __name__ == "__main__":
+
+    # one-off conversion of the per-country GeoPackages into the GeoParquet index
+    build_index()
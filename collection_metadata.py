@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+import ee
+from tracing import span
+
+
+CACHE_DIR = os.environ.get("GEE_METADATA_CACHE", os.path.expanduser("~/.cache/gee_demo/collections"))
+DEFAULT_TTL = 7 * 24 * 3600
+
+_memory = {}
+_lock = threading.Lock()
+_key_locks = {}
+
+
+def first_band(band):
+    # the scale of a selection is the scale of its first band, as dataset.first().projection()
+    if isinstance(band, (list, tuple)):
+        return band[0] if band else None
+    return band
+
+
+def cache_key(collection_id, band=None):
+    return collection_id if band is None else f"{collection_id}:{band}"
+
+
+def cache_file(collection_id, cache_dir=None, band=None):
+    name = collection_id.replace('/', '__') + ("" if band is None else f"__{band}")
+    return f"{cache_dir or CACHE_DIR}/{name}.json"
+
+
+def fetch_collection_metadata(collection_id, band=None):
+    # scale, CRS, band list and date extent in a single getInfo round trip; mixed-resolution
+    # collections (MOD09GA, Sentinel-2) need the band that is actually reduced or downloaded
+    collection = ee.ImageCollection(collection_id)
+    first = collection.first()
+    projection = first.select(0 if band is None else band).projection()
+    metadata = ee.Dictionary({
+        "scale": projection.nominalScale(),
+        "crs": projection.crs(),
+        "bands": first.bandNames(),
+        "start": collection.aggregate_min("system:time_start"),
+        "end": collection.aggregate_max("system:time_start"),
+    })
+    with span("getInfo"):
+        info = metadata.getInfo()
+    info["collection_id"] = collection_id
+    info["band"] = band
+    info["fetched"] = time.time()
+    return info
+
+
+def read_cached(collection_id, cache_dir=None, band=None):
+    path = cache_file(collection_id, cache_dir, band)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def write_cached(info, cache_dir=None):
+    path = cache_file(info["collection_id"], cache_dir, info.get("band"))
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump(info, fd)
+    os.replace(tmp_path, path)
+
+
+def get_collection_metadata(collection_id, band=None, ttl=DEFAULT_TTL, offline=False, cache_dir=None):
+    # memory first, then the on-disk cache, then Earth Engine; offline ignores the TTL and never calls GEE.
+    # cached per (collection, band), band None is the first band of the collection
+    band = first_band(band)
+    key = cache_key(collection_id, band)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # one lock per (collection, band): a cold lookup does not hold up other keys,
+    # and concurrent lookups of the same key share a single getInfo
+    with key_lock:
+        info = _memory.get(key)
+        if info is None:
+            info = read_cached(collection_id, cache_dir, band)
+
+        if info is not None and (offline or time.time() - info["fetched"] < ttl):
+            _memory[key] = info
+            return info
+
+        if offline:
+            raise KeyError(f"no cached metadata for {key}")
+
+        info = fetch_collection_metadata(collection_id, band)
+        write_cached(info, cache_dir)
+        _memory[key] = info
+        return info
+
+
+def get_scale(collection_id, band=None, **kwargs):
+    return get_collection_metadata(collection_id, band, **kwargs)["scale"]
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from osgeo import gdal
+
+
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def validate_geotiff(path):
+    # GEE error bodies are JSON/HTML, a truncated body fails to open in GDAL
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False, "empty file"
+    with open(path, "rb") as fd:
+        if fd.read(4) not in TIFF_MAGIC:
+            return False, "not a TIFF"
+    ds = gdal.Open(path, gdal.GA_ReadOnly)
+    if ds is None or ds.RasterCount == 0:
+        return False, "unreadable GeoTIFF"
+    try:
+        ds.GetRasterBand(1).Checksum()
+    except Exception as e:
+        return False, str(e)
+    ds = None
+    return True, ""
+
+
+class DownloadManifest:
+    def __init__(self, path):
+
+        self.path = path
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                key TEXT PRIMARY KEY,
+                bbox TEXT,
+                start_date TEXT,
+                end_date TEXT,
+                path TEXT,
+                status TEXT,
+                bytes INTEGER,
+                sha256 TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                updated REAL
+            )""")
+        self._conn.commit()
+
+    @staticmethod
+    def key(bbox, start_date, end_date):
+        return "_".join(map(str, list(bbox) + [start_date, end_date]))
+
+    def status(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM tiles WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, key, path):
+        return self.status(key) == "done" and os.path.exists(path)
+
+    def _upsert(self, key, bbox, start_date, end_date, path, status, size, sha, error):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO tiles (key, bbox, start_date, end_date, path, status, bytes, sha256, error, attempts, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    path = excluded.path, status = excluded.status, bytes = excluded.bytes,
+                    sha256 = excluded.sha256, error = excluded.error,
+                    attempts = tiles.attempts + 1, updated = excluded.updated
+                """, (key, ",".join(map(str, bbox)), start_date, end_date, path, status, size, sha, error, time.time()))
+            self._conn.commit()
+
+    def mark_done(self, key, bbox, start_date, end_date, path):
+        self._upsert(key, bbox, start_date, end_date, path, "done",
+                     os.path.getsize(path), file_sha256(path), None)
+
+    def mark_failed(self, key, bbox, start_date, end_date, path, error):
+        self._upsert(key, bbox, start_date, end_date, path, "failed", None, None, str(error))
+
+    def commit_file(self, key, bbox, start_date, end_date, tmp_path, path):
+        # validate the temporary download and only then rename it into place
+        ok, error = validate_geotiff(tmp_path)
+        if not ok:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.mark_failed(key, bbox, start_date, end_date, path, error)
+            return False
+        os.replace(tmp_path, path)
+        self.mark_done(key, bbox, start_date, end_date, path)
+        return True
+
+    def adopt_existing(self, key, bbox, start_date, end_date, path):
+        # files written before the manifest existed are kept only if they are valid
+        ok, error = validate_geotiff(path)
+        if ok:
+            self.mark_done(key, bbox, start_date, end_date, path)
+        else:
+            os.remove(path)
+        return ok
+
+    def summary(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*), SUM(bytes) FROM tiles GROUP BY status").fetchall()
+        return {status: {"tiles": count, "bytes": size or 0} for status, count, size in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+
+
+# modules implementing the part of the earthengine-api used by the pipelines
+BACKENDS = {
+    "earthengine": "ee",
+    "mock": "mock_ee",
+}
+
+# e.g. GEE_BACKEND=mock python nigthlight.py runs without a GEE account against the local
+# stand-in (synthetic rasters, local HTTP server); unset keeps the earthengine-api
+ENV_BACKEND = os.environ.get("GEE_BACKEND")
+
+_earthengine = None
+
+
+def use_backend(backend="mock"):
+    # swap the module behind `import ee`: for modules imported afterwards through
+    # sys.modules, and for the `ee` global of modules imported already
+    global _earthengine
+    current = sys.modules.get("ee")
+    if current is not None and getattr(current, "BACKEND", None) is None:
+        _earthengine = current
+
+    if not isinstance(backend, str):
+        module = backend
+    elif backend == "earthengine":
+        if _earthengine is None:
+            sys.modules.pop("ee", None)
+            _earthengine = importlib.import_module("ee")
+        module = _earthengine
+    else:
+        module = importlib.import_module(BACKENDS.get(backend, backend))
+
+    if current is not None and current is not module:
+        for name, mod in list(sys.modules.items()):
+            if name == "ee" or name.startswith("ee.") or mod is None:
+                continue
+            if getattr(mod, "ee", None) is current:
+                mod.ee = module
+    sys.modules["ee"] = module
+    return module
+
+
+def use_env_backend():
+    # called by the scripts' __main__, a no-op unless GEE_BACKEND is set
+    if ENV_BACKEND:
+        return use_backend(ENV_BACKEND)
+    return sys.modules.get("ee")
+
+
+def get_backend():
+    module = sys.modules.get("ee")
+    return getattr(module, "BACKEND", "earthengine") if module is not None else None
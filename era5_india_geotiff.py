@@ -1,41 +1,21 @@
-import io
-import numpy as np
 import os
 from osgeo import gdal
 import ee
 import pandas as pd
-import geopandas as gpd
 import json
 import shapely
-shapely.speedups.disable()
+if hasattr(shapely, "speedups"):
+    # removed in shapely 2.1
+    shapely.speedups.disable()
+from raster_io import geotiff_to_xyz, npy_to_array, to_cog
+from http_download import download_to_file, get_session
+from auto_tiler import download_tiled, region_to_shapely, scale_to_degrees
+from boundary_store import get_boundaries
+from collection_metadata import get_scale
+from raster_cube import download_cube, plan_grid
+from tracing import file_size, span, traced
 
 
-def geotiff_to_xyz(in_geotiff, out_xyz_path):
-    format = "XYZ"
-    driver = gdal.GetDriverByName(format)
-    out_csv = out_xyz_path.replace("parquet.gzip", "csv")
-    # Output to new format
-    ds = gdal.Open(in_geotiff, gdal.GA_ReadOnly)
-    nodata = ds.GetRasterBand(1).GetNoDataValue()
-    driver.CreateCopy(out_csv, ds, -999)
-
-    # BUILD XYZ dataset
-    xyz = pd.read_csv(out_csv, sep=" ", names=["lon", "lat", "value"], header=None)
-    xyz = xyz.reset_index()
-    xyz.loc[xyz['value'] == "-nan(ind)", "value"] = ""
-    xyz["lon"] = xyz["lon"].round(2)
-    xyz["lat"] = xyz["lat"].round(2)
-
-    xyz["value"] = pd.to_numeric(xyz["value"]).round(4)
-
-    xyz = xyz.dropna()
-    xyz = xyz.loc[~(xyz.value == nodata)]
-    xyz = xyz.loc[~(xyz.value == -999)]
-    xyz[["lat", "lon", "value"]].to_parquet(out_xyz_path, compression="gzip")
-    os.remove(out_csv)
-
-    return True
-
 def warp_to_resolution(in_path,out_path,resolution):
     # Resample with GDAL warp
     source_image_metadata = gdal.Open(in_path,gdal.GA_ReadOnly)
@@ -54,29 +34,30 @@ def warp_to_resolution(in_path,out_path,resolution):
 
 
     try:
-        gdal.Warp(out_path,
-                          in_path,
-                          dstSRS='EPSG:4326',
-                          outputType=gdal.GDT_UInt16,
-                          xRes=resolution, yRes=resolution,
-                          resampleAlg="average",
-                          options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
-                          )
+        with span("gdal_warp") as trace:
+            gdal.Warp(out_path,
+                              in_path,
+                              dstSRS='EPSG:4326',
+                              outputType=gdal.GDT_UInt16,
+                              xRes=resolution, yRes=resolution,
+                              resampleAlg="average",
+                              options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
+                              )
+            trace["bytes"] = file_size(out_path)
 
         return True
     except Exception as e:
         print(e)
 
 
+@traced("getArea")
 def getArea(GID_0,LEVEL_AGG):
-    area = gpd.read_file(f'reference_datasets/gadm_401_GID_1/{GID_0[0:3]}.gpkg')
     if LEVEL_AGG == "GID_0":
-        area = area.dissolve("GID_0").reset_index()
+        area = get_boundaries(GID_0[0:3], "GID_0")
         area.drop(columns=['GID_1', 'NAME_1'], axis=1, inplace=True )
 
     if LEVEL_AGG == "GID_1":
-        area = area.loc[area.GID_1 == GID_0]
-        area = area.dissolve("GID_1").reset_index()
+        area = get_boundaries(GID_0, "GID_1")
         area.drop(columns=['GID_0', 'NAME_0'], axis=1, inplace=True )
 
 
@@ -97,7 +78,7 @@ class MyGEEClass:
 
     def get_any_image_median(self):
 
-        self.SCALE = ee.ImageCollection(self.SATELLITE).first().projection().nominalScale().getInfo()
+        self.SCALE = get_scale(self.SATELLITE, self.BANDS)
 
         image = ee.ImageCollection(self.SATELLITE) \
             .filterDate(self.START_DATE, self.END_DATE) \
@@ -108,34 +89,82 @@ class MyGEEClass:
 
         return image
 
-    def get_image_to_garray(self):
-        response = self.get_image_url()
-        data = np.load(io.BytesIO(response.content))
-        return data
-
-    def get_image_url(self):
-        import requests
+    def get_image_to_garray(self, geometry=None):
+        # NPY pixels on an explicit grid, straight into a structured array (one field per band)
+        if geometry is None:
+            geometry = region_to_shapely(self.REGION)
+        transform, width, height, _, _ = plan_grid(geometry.bounds, scale_to_degrees(self.SCALE))
+
+        with span("computePixels") as trace:
+            data = ee.data.computePixels({
+                'expression': self.image,
+                'fileFormat': 'NPY',
+                'bandIds': self.BANDS,
+                'grid': {
+                    'dimensions': {'width': width, 'height': height},
+                    'affineTransform': {
+                        'scaleX': transform[0], 'shearX': transform[1], 'translateX': transform[2],
+                        'shearY': transform[3], 'scaleY': transform[4], 'translateY': transform[5],
+                    },
+                    'crsCode': "EPSG:4326",
+                },
+            })
+            trace["bytes"] = len(data)
+        geo_t = (transform[2], transform[0], transform[1], transform[5], transform[3], transform[4])
+        return npy_to_array(data), geo_t
+
+    def get_download_url(self):
         image = self.image
 
-        path = image.getDownloadUrl({
-            'bands': self.BANDS,
-            'scale': self.SCALE,
-            'crs': "EPSG:4326",
-            'region': self.REGION.geometry(),
-            'format': 'GEO_TIFF'
-        })
+        with span("getDownloadUrl"):
+            path = image.getDownloadUrl({
+                'bands': self.BANDS,
+                'scale': self.SCALE,
+                'crs': "EPSG:4326",
+                'region': self.REGION.geometry(),
+                'format': 'GEO_TIFF'
+            })
+        return path
 
-        response = requests.get(path)
+    def get_image_url(self):
+        path = self.get_download_url()
+        with span("http_download") as trace:
+            response = get_session().get(path)
+            trace["bytes"] = len(response.content)
         return response
 
-    def get_image_to_file(self):
+    def get_image_to_file(self, cog=False):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        response = self.get_image_url()
+        # streamed in chunks to a temp file, the body is never held in memory
+        download_to_file(self.get_download_url(), self.output_file)
+        if cog:
+            to_cog(self.output_file)
+
+    def get_image_to_file_tiled(self, geometry=None, bytes_per_pixel=2, max_workers=8):
+        # split the region only where a single request would exceed the GEE size limits
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        if geometry is None:
+            geometry = region_to_shapely(self.REGION)
+
+        return download_tiled(self.image, self.BANDS, self.SCALE, geometry, self.output_file,
+                              bytes_per_pixel=bytes_per_pixel, max_workers=max_workers)
+
+    def get_image_cube(self, out_path, intervalUnit="month", timeWindowLength=1, temporal_reducer="median",
+                       geometry=None, max_workers=4):
+        # one composite per interval from START_DATE to END_DATE into a (time, band, y, x) zarr cube
+        if self.SCALE is None:
+            self.SCALE = get_scale(self.SATELLITE, self.BANDS)
+        if geometry is None:
+            geometry = region_to_shapely(self.REGION)
 
-        with open(self.output_file, 'wb') as fd:
-                fd.write(response.content)
+        return download_cube(self.SATELLITE, self.BANDS, self.REGION, geometry.bounds,
+                             self.START_DATE, self.END_DATE, out_path, self.SCALE,
+                             intervalUnit=intervalUnit, timeWindowLength=timeWindowLength,
+                             temporal_reducer=temporal_reducer, max_workers=max_workers)
 
 
 
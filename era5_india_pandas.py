@@ -1,13 +1,14 @@
 import ee
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 import json
+from boundary_store import get_boundaries
+from collection_metadata import get_scale
+import get_gee_PANELDATA
+import panel_store
 
 def getArea(GID_0):
-    area = gpd.read_file(f'../../reference_datasets/gadm_401_GID_1/{GID_0[0:3]}.gpkg')
-
-    area = area.loc[area.GID_0 == GID_0]
+    area = get_boundaries(GID_0, base_dir='../../reference_datasets/gadm_401_GID_1')
     #area = area.dissolve("GID_0").reset_index()
     #area.geometry = area.simplify(0.1)
     area = ee.FeatureCollection(json.loads(area.to_json()))
@@ -51,6 +52,7 @@ class ZsGEE:
 
         # Defines mean, standard deviation, and variance as the zonal statistics.
         spatialReducers = ee.Reducer.sum()
+        scale = get_scale(self.satellite, self.bands)
         # Get time window index sequence.
         intervals = ee.List.sequence(0, intervalCount - 1, interval)
 
@@ -66,7 +68,7 @@ class ZsGEE:
             statsL = temporalStat.reduceRegions(
                 collection=area,
                 reducer=spatialReducers,
-                scale= dataset.first().projection().nominalScale().getInfo(),
+                scale=scale,
                 crs=dataset.first().projection()
             )
 
@@ -88,6 +90,22 @@ class ZsGEE:
         return out_pd
 
 
+def update_precipitation_store(store_dir, GadmGID='YEM', datestart="2013-01-01"):
+    # monthly refresh without rebuilding the history: the shared ZsGEE appends only the
+    # months after the last one already in the partitioned parquet store
+    myPanelData = get_gee_PANELDATA.ZsGEE()
+    myPanelData.timeWindowLength = 1
+    myPanelData.intervalUnit = "month"
+    myPanelData.datestart = datestart
+    myPanelData.satellite = "ECMWF/ERA5_LAND/MONTHLY_AGGR"
+    myPanelData.bands = ["total_precipitation_sum"]
+    myPanelData.temporal_reducer = "sum"
+    myPanelData.spatial_reducers = ["sum"]
+    myPanelData.GadmGID = GadmGID
+    myPanelData.update_store(store_dir)
+    return panel_store.read_store(store_dir)
+
+
 
 
 if __name__ == '__main__':
@@ -135,7 +153,3 @@ if __name__ == '__main__':
     dfs.append(df)
     dfs = pd.concat(dfs)
     dfs.to_csv("total_precipitation_yemen_2013-2023.csv")
-
-
-
-
@@ -1,38 +1,116 @@
 import ee
-import numpy as np
 import pandas as pd
-import geopandas as gpd
+import pyarrow as pa
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import shapely
-shapely.speedups.disable()
-
+if hasattr(shapely, "speedups"):
+    # removed in shapely 2.1
+    shapely.speedups.disable()
+from boundary_store import get_boundaries
+from collection_metadata import get_scale
+from panel_cache import PanelCache, request_hash
+import ee_backend
+import panel_store
+from reducer_graph import PanelRequest, DEFAULT_SPATIAL_REDUCERS, as_list
+from tracing import span, traced
+
+
+# errors that mean the request is too big for one call and should be split rather than retried
+SIZE_ERRORS = (
+    "memory limit exceeded",
+    "computation timed out",
+    "too many concurrent aggregations",
+    "accumulating over",
+    "payload size exceeds",
+    "response size exceeds",
+)
+# errors worth the same request again after a backoff, anything else is raised at once
+TRANSIENT_ERRORS = (
+    "service unavailable",
+    "too many requests",
+    "quota",
+    "deadline",
+    "internal error",
+    "capacity exceeded",
+    "rate limit",
+)
+
+
+@traced("getArea")
+def getAreaFrame(GID_0):
+    # a single GID or a list of them, all regions end up in one GeoDataFrame
+    gids = GID_0 if isinstance(GID_0, (list, tuple)) else [GID_0]
+    return pd.concat([get_boundaries(gid, "GID_1", 0.1) for gid in gids], ignore_index=True)
 
 def getArea(GID_0):
-    area = gpd.read_file(f'reference_datasets/gadm_401_GID_1/{GID_0[0:3]}.gpkg')
-
-    area = area.loc[area.GID_0 == GID_0]
-    area = area.dissolve("GID_1").reset_index()
-    area.geometry = area.simplify(0.1)
+    area = getAreaFrame(GID_0)
     area = ee.FeatureCollection(json.loads(area.to_json()))
     return area
 
-def fc_to_dict(fc):
-    prop_names = fc.first().propertyNames()
-    prop_lists = fc.reduceColumns(
-        reducer=ee.Reducer.toList().repeat(prop_names.size()), selectors=prop_names
-    ).get("list")
-
-    return ee.Dictionary.fromLists(prop_names, prop_lists)
-
-def pad_dict_list(dict_list, padel):
-    lmax = 0
-    for lname in dict_list.keys():
-        lmax = max(lmax, len(dict_list[lname]))
-    for lname in dict_list.keys():
-        ll = len(dict_list[lname])
-        if ll < lmax:
-            dict_list[lname] += [padel] * (lmax - ll)
-    return dict_list
+def is_size_error(e):
+    message = str(e).lower()
+    return any(err in message for err in SIZE_ERRORS)
+
+def is_transient_error(e):
+    message = str(e).lower()
+    return any(err in message for err in TRANSIENT_ERRORS)
+
+def count_intervals(startDate, endDate, intervalUnit):
+    # number of intervalUnit steps between the two dates, same meaning as intervalCount
+    start = pd.Timestamp(startDate)
+    end = pd.Timestamp(endDate)
+    count = 0
+    while start + pd.DateOffset(**{f"{intervalUnit}s": count}) < end:
+        count += 1
+    return count
+
+CATEGORICAL_COLUMNS = ("GID_0", "NAME_0", "GID_1", "NAME_1")
+# set on every feature by PanelRequest.compile, present even when nothing came back
+PANEL_COLUMNS = {"system:index": "object", "composite_start": "int32", "interval_offset": "int64"}
+
+
+def fc_to_features(fc):
+    # keep one row per feature and drop the geometries from the payload
+    return fc.select(['.*'], None, False)
+
+def features_to_frame(info):
+    # typed columns built from the feature rows, a property missing on one feature is a null
+    # in that row instead of shifting the rest of the column
+    rows = []
+    for feature in info["features"]:
+        row = {"system:index": feature.get("id")}
+        row.update(feature.get("properties") or {})
+        rows.append(row)
+
+    if not rows:
+        return typed_panel(pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in PANEL_COLUMNS.items()}))
+
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    table = pa.table({column: column_array([row.get(column) for row in rows]) for column in columns})
+    return typed_panel(table.to_pandas())
+
+def column_array(values):
+    # a property holding strings on some features and numbers on others is kept as strings
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+def typed_panel(df):
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    if "composite_start" in df.columns:
+        # 'YYYYMM' strings as integer periods
+        df["composite_start"] = pd.to_numeric(df["composite_start"]).astype("int32")
+    return df
+
+def has_data(df):
+    # an empty window has no statistic columns at all, or only nulls in them
+    values = df.select_dtypes("number").drop(columns=["composite_start", "interval_offset"], errors="ignore")
+    return bool(values.notna().any().any())
 
 class ZsGEE:
 
@@ -40,71 +118,175 @@ class ZsGEE:
 
         # some init here
         self.some_var_here = ""
+        self.dateend = None
+        self.chunk_intervals = 12
+        self.max_workers = 4
+        self.element_budget = 5000  # time windows x features per getInfo call
+        self.max_retries = 3
+        self.use_cache = True
+        self.cache_dir = None
+        self.cache_ttl = 30 * 24 * 3600  # seconds, None never expires
+        self.temporal_reducer = "median"  # a name or a list of names, e.g. ["median", "max"]
+        self.spatial_reducers = list(DEFAULT_SPATIAL_REDUCERS)
+
+    def get_interval_offsets(self):
+        # either an explicit intervalCount or a [datestart, dateend) range
+        if self.dateend is not None:
+            intervalCount = count_intervals(self.datestart, self.dateend, self.intervalUnit)
+        else:
+            intervalCount = self.intervalCount
+        return list(range(0, intervalCount, self.timeWindowLength))
+
+    def get_interval_start(self, offset):
+        return pd.Timestamp(self.datestart) + pd.DateOffset(**{f"{self.intervalUnit}s": offset})
+
+    def is_complete(self, offset, dateend=None):
+        # the whole window lies before dateend (default: today), so its composite will not change
+        if dateend is None:
+            dateend = pd.Timestamp.today().normalize()
+        return self.get_interval_start(offset + self.timeWindowLength) <= dateend
+
+    def get_panel_request(self):
+        return PanelRequest(self.satellite, self.bands, self.datestart,
+                            intervalUnit=self.intervalUnit,
+                            timeWindowLength=self.timeWindowLength,
+                            temporal_reducers=self.temporal_reducer,
+                            spatial_reducers=self.spatial_reducers,
+                            # resolved once from the metadata cache instead of a getInfo while the graph is built
+                            scale=get_scale(self.satellite, as_list(self.bands)))
+
+    def get_request(self):
+        # everything that defines the values of one interval, but not which intervals
+        request = {
+            "satellite": self.satellite,
+            "bands": as_list(self.bands),
+            "gids": sorted(as_list(self.GadmGID)),
+            "temporal_reducers": list(dict.fromkeys(as_list(self.temporal_reducer))),
+            "spatial_reducers": list(dict.fromkeys(as_list(self.spatial_reducers))),
+            "intervalUnit": self.intervalUnit,
+            "timeWindowLength": self.timeWindowLength,
+            "simplify": 0.1,
+        }
+        return request
+
+    def plan_chunks(self, n_features, offsets=None):
+        # (interval offsets, feature slice) pairs of at most element_budget elements each;
+        # features are only split when a single window is already over budget, so the
+        # time-major row order of the unchunked request is kept
+        if offsets is None:
+            offsets = self.get_interval_offsets()
+        features_per_chunk = max(1, min(n_features, self.element_budget))
+        windows_per_chunk = max(1, min(self.chunk_intervals, self.element_budget // features_per_chunk))
+
+        chunks = []
+        for i in range(0, len(offsets), windows_per_chunk):
+            for j in range(0, n_features, features_per_chunk):
+                chunks.append((offsets[i:i + windows_per_chunk], (j, min(j + features_per_chunk, n_features))))
+        return chunks
+
+    def fetch_chunk(self, area, request, offsets, features, attempt=0):
+        start, end = features
+        try:
+            chunk_area = ee.FeatureCollection(json.loads(area.iloc[start:end].to_json()))
+            return self.fetch_dataframe(request.compile(chunk_area, offsets))
+        except ee.EEException as e:
+            args = (area, request)
+            # too big: halve the time windows first, then the features
+            if is_size_error(e) and len(offsets) > 1:
+                half = len(offsets) // 2
+                return pd.concat([self.fetch_chunk(*args, offsets[:half], features),
+                                  self.fetch_chunk(*args, offsets[half:], features)], ignore_index=True)
+            if is_size_error(e) and end - start > 1:
+                half = start + (end - start) // 2
+                return pd.concat([self.fetch_chunk(*args, offsets, (start, half)),
+                                  self.fetch_chunk(*args, offsets, (half, end))], ignore_index=True)
+            # size errors that cannot be split further are retried like transient ones
+            if (is_transient_error(e) or is_size_error(e)) and attempt < self.max_retries:
+                time.sleep(2 ** attempt)
+                return self.fetch_chunk(*args, offsets, features, attempt + 1)
+            raise
+
+    def fetch_dataframe(self, zonalStatsL):
+        with span("getInfo"):
+            output = fc_to_features(zonalStatsL).getInfo()
+        return features_to_frame(output)
+
+    def get_interval_frames(self, offsets):
+        # intervals already in the cache are read back, only the missing ones go to GEE
+        cache = PanelCache(self.cache_dir, self.cache_ttl) if self.use_cache else None
+        request = self.get_request()
+        key = request_hash(request)
+        results = {}
+        if cache is not None:
+            for offset in offsets:
+                df = cache.read(key, self.get_interval_start(offset))
+                if df is not None:
+                    results[offset] = df
+
+        missing = [offset for offset in offsets if offset not in results]
+        if missing:
+            computed = self.compute_dataframe(missing)
+            # no features came back at all: nothing to split, cache or return
+            groups = computed.groupby("interval_offset", sort=False) if len(computed) else []
+            for offset, df in groups:
+                offset = int(offset)
+                df = df.drop(columns=["interval_offset"]).reset_index(drop=True)
+                # the current window and windows without images yet are returned but not cached
+                if cache is not None and self.is_complete(offset) and has_data(df):
+                    cache.write(key, self.get_interval_start(offset), df, request)
+                results[offset] = df
+
+        return results
 
     def get_dataframe(self):
 
-        startDate =  self.datestart  # '2000-03-01' # time period of interest beginning date
-        interval = self.timeWindowLength  # time window length
-        intervalUnit = self.intervalUnit #'month'  # unit of time e.g. 'year', 'month', 'day'
-        intervalCount = self.intervalCount  # 275 # number of time windows in the series
+        offsets = self.get_interval_offsets()
+        results = self.get_interval_frames(offsets)
 
-        area = getArea(self.GadmGID)
+        frames = [results[offset] for offset in offsets if offset in results]
+        if not frames:
+            return features_to_frame({"features": []})
+        out_pd = pd.concat(frames, ignore_index=True)
+        # categories differ between intervals, restore the categorical dtypes after the concat
+        return typed_panel(out_pd)
 
-        dataset = ee.ImageCollection(self.satellite).select(self.bands)
+    def update_store(self, store_dir, dateend=None):
+        # incremental mode: continue after the last interval in the store and
+        # compute only the complete windows up to dateend (default: today)
+        last = panel_store.last_interval_start(store_dir)
+        if last is not None:
+            self.datestart = (last + pd.DateOffset(**{f"{self.intervalUnit}s": self.timeWindowLength})).strftime("%Y-%m-%d")
+        self.dateend = pd.Timestamp(dateend) if dateend is not None else pd.Timestamp.today().normalize()
 
-        if self.temporal_reducer == "mean":
-            temporalReducer = ee.Reducer.mean()  # how to reduce images in time window
+        offsets = [offset for offset in self.get_interval_offsets() if self.is_complete(offset, self.dateend)]
+        if not offsets:
+            return []
 
-        if self.temporal_reducer == "sum":
-            temporalReducer = ee.Reducer.sum()
+        results = self.get_interval_frames(offsets)
+        written = []
+        for offset in offsets:
+            if offset in results:
+                written.append(panel_store.write_interval(store_dir, self.get_interval_start(offset), results[offset]))
+        return written
 
-        if self.temporal_reducer == "median":
-            temporalReducer = ee.Reducer.median()
+    def compute_dataframe(self, offsets):
 
-        # Defines mean, standard deviation, and variance as the zonal statistics.
-        spatialReducers = ee.Reducer.mean().combine(
-            reducer2=ee.Reducer.stdDev(),
-            sharedInputs=True
-        ).combine(
-            reducer2=ee.Reducer.variance(),
-            sharedInputs=True
-        ).combine(
-            reducer2=ee.Reducer.sum(),
-            sharedInputs=True
-        )
-        # Get time window index sequence.
-        intervals = ee.List.sequence(0, intervalCount - 1, interval)
+        area = getAreaFrame(self.GadmGID)
 
-        # Map reductions over index sequence to calculate statistics for each interval.
-        def a(i):
-            # Calculate temporal composite.
-            startRangeL = ee.Date(startDate).advance(i, intervalUnit)
-            endRangeL = startRangeL.advance(interval, intervalUnit)
-            temporalStat = dataset.filterDate(startRangeL, endRangeL).reduce(temporalReducer)
+        # one request object for every chunk, so the composites and reducers are built once
+        request = self.get_panel_request()
 
-            # Calculate zonal statistics.
-            statsL = temporalStat.reduceRegions(
-                collection=area,
-                reducer=spatialReducers,
-                scale= dataset.first().projection().nominalScale().getInfo(),
-                crs=dataset.first().projection()
-            )
+        # independent chunks are fetched concurrently and concatenated in order
+        chunks = self.plan_chunks(len(area), offsets)
 
-            # Set start date as a feature property.
+        def run(chunk):
+            offsets, features = chunk
+            return self.fetch_chunk(area, request, offsets, features)
 
-            def b(feature):
-                #  or 'YYYY-MM-dd'
-                return feature.set({'composite_start': startRangeL.format('YYYYMM')})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            dfs = list(pool.map(run, chunks))
 
-            return statsL.map(b)
-
-        zonalStatsL = intervals.map(a)
-
-        zonalStatsL = ee.FeatureCollection(zonalStatsL).flatten()
-
-        output = fc_to_dict(zonalStatsL).getInfo()
-        output = pad_dict_list(output, np.nan)
-        out_pd = pd.DataFrame(output)
+        out_pd = pd.concat(dfs, ignore_index=True)
         return out_pd
 
 
@@ -112,6 +294,8 @@ class ZsGEE:
 
 if __name__ == '__main__':
 
+    ee_backend.use_env_backend()
+
     credentials = ee.ServiceAccountCredentials(
         "test1-landsat8@geelandsat8.iam.gserviceaccount.com",
         "geelandsat8-6af86334d7ec.json",
@@ -128,6 +312,11 @@ if __name__ == '__main__':
     myPanelData.bands = "NDVI"
     myPanelData.temporal_reducer = "median"
     myPanelData.GadmGID = 'ITA'
+    # or several regions and a date range in one batch:
+    #myPanelData.GadmGID = ['ITA', 'FRA', 'ESP']
+    #myPanelData.dateend = "2005-03-01"
+    # or keep a partitioned parquet store up to date, only new months are computed:
+    #myPanelData.update_store("OUTPUT/PANELS/MOD13A2_NDVI_ITA")
 
     df = myPanelData.get_dataframe()
     print(df)
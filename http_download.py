@@ -0,0 +1,120 @@
+import os
+import tempfile
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tracing import span
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(pool_maxsize=10, retries=5, backoff_factor=1.0):
+    # keep-alive connection pool with retry/backoff on 429 and 5xx
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+class DownloadStats:
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latencies = []
+
+    def record(self, size, latency, seconds):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.latencies.append(latency)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def summary(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            n = len(latencies)
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "bytes": self.bytes,
+                "bytes_per_sec": self.bytes / self.seconds if self.seconds else 0.0,
+                "latency_mean": sum(latencies) / n if n else 0.0,
+                "latency_p50": latencies[n // 2] if n else 0.0,
+                "latency_p95": latencies[min(n - 1, int(n * 0.95))] if n else 0.0,
+            }
+
+
+STATS = DownloadStats()
+
+
+def download_to_file(url, out_path, session=None, chunk_size=CHUNK_SIZE, timeout=300, stats=STATS, atomic=True):
+    # stream the body to a temporary file next to out_path and rename it when complete;
+    # atomic=False writes out_path directly, for callers that already stage the file
+    session = session or get_session()
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    start = time.perf_counter()
+    with span("http_download") as trace:
+        try:
+            with session.get(url, stream=True, timeout=timeout) as response:
+                latency = time.perf_counter() - start
+                response.raise_for_status()
+
+                if atomic:
+                    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".part")
+                else:
+                    tmp_path = out_path
+                    fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+                size = 0
+                try:
+                    with os.fdopen(fd, "wb") as out:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            out.write(chunk)
+                            size += len(chunk)
+                    if atomic:
+                        os.replace(tmp_path, out_path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+        except Exception:
+            stats.record_failure()
+            raise
+        trace["bytes"] = size
+
+    stats.record(size, latency, time.perf_counter() - start)
+    return size
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+from zone_masks import SUPERSAMPLE, get_zone_masks
+
+
+STATS = ("mean", "stdDev", "variance", "sum")
+
+
+def grouped_stats(values, masks, n_zones, nodata=None):
+    # the cached sparse masks turn every time slice into pure indexing plus weighted
+    # bincounts of weight, sum and sum of squares per zone
+    v = values.ravel()[masks["indices"]]
+    valid = np.ones(v.shape, dtype=bool)
+    if np.issubdtype(v.dtype, np.floating):
+        valid &= ~np.isnan(v)
+    if nodata is not None:
+        valid &= v != nodata
+
+    zones = masks["zones"][valid]
+    w = masks["weights"][valid].astype(np.float64)
+    v = v[valid].astype(np.float64)
+    weight = np.bincount(zones, weights=w, minlength=n_zones)
+    total = np.bincount(zones, weights=w * v, minlength=n_zones)
+    total_sq = np.bincount(zones, weights=w * v * v, minlength=n_zones)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / weight
+        # population variance, as ee.Reducer.variance / stdDev, weighted by pixel coverage
+        variance = np.maximum(total_sq / weight - mean * mean, 0)
+    total[weight == 0] = np.nan
+
+    return {"mean": mean, "stdDev": np.sqrt(variance), "variance": variance, "sum": total}
+
+
+def band_names(ds, bands=None):
+    if bands is not None:
+        return list(bands)
+    names = []
+    for i in range(1, ds.RasterCount + 1):
+        names.append(ds.GetRasterBand(i).GetDescription() or f"b{i}")
+    return names
+
+
+def zonal_stats(raster_paths, area, composite_starts, bands=None, stats=STATS, supersample=SUPERSAMPLE):
+    # raster_paths: one raster per time slice, all on the same grid as the first one
+    properties = pd.DataFrame(area.drop(columns=area.geometry.name)).reset_index(drop=True)
+    n_zones = len(properties)
+
+    masks = None
+    grid = None
+    frames = []
+    for k, (path, composite_start) in enumerate(zip(raster_paths, composite_starts)):
+        ds = gdal.Open(path, gdal.GA_ReadOnly)
+        geo_t = ds.GetGeoTransform()
+        shape = (ds.RasterYSize, ds.RasterXSize)
+        if masks is None:
+            grid = (geo_t, shape)
+            masks = get_zone_masks(area, geo_t, shape, supersample)
+        elif (geo_t, shape) != grid:
+            raise ValueError(f"{path} is not on the same grid as {raster_paths[0]}")
+
+        names = band_names(ds, bands)
+        out = properties.copy()
+        for i, name in enumerate(names):
+            band = ds.GetRasterBand(i + 1)
+            result = grouped_stats(band.ReadAsArray(), masks, n_zones, band.GetNoDataValue())
+            for stat in stats:
+                # same naming as reduceRegions: bare reducer names for a single band
+                column = stat if len(names) == 1 else f"{name}_{stat}"
+                out[column] = result[stat]
+        out["composite_start"] = composite_start
+        out["system:index"] = [f"{k}_{j}" for j in range(n_zones)]
+        frames.append(out)
+        ds = None
+
+    return pd.concat(frames, ignore_index=True)
+
+
+class ZsLocal:
+
+    def __init__(self,):
+
+        # offline counterpart of ZsGEE over rasters already downloaded with MyGEEClass
+        self.rasters = []
+        self.composite_starts = []
+        self.bands = None
+        self.GadmGID = None
+        self.area = None
+
+    def get_dataframe(self):
+        area = self.area
+        if area is None:
+            from get_gee_PANELDATA import getAreaFrame
+            area = getAreaFrame(self.GadmGID)
+        return zonal_stats(self.rasters, area, self.composite_starts, self.bands)
@@ -0,0 +1,832 @@
+import abc
+import io
+import math
+import random
+import re
+import threading
+import time
+import uuid
+import warnings
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from affine import Affine
+from osgeo import gdal, osr
+from rasterio.features import geometry_mask
+from shapely.geometry import box, mapping, shape
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+from zone_masks import SUPERSAMPLE, zone_coverage
+
+
+# local stand-in for the subset of the earthengine-api used by the pipelines,
+# switched in with ee_backend.use_backend("mock")
+BACKEND = "mock"
+METERS_PER_DEGREE = 111319.49
+
+CONFIG = {
+    "rpc_latency": 0.0,  # seconds, or a (min, max) range, per getInfo / getDownloadUrl / computePixels
+    "http_latency": 0.0,  # seconds before a download starts
+    "rpc_failure_rate": 0.0,  # fraction of RPCs raising EEException
+    "http_failure_rate": 0.0,  # fraction of downloads answered with a 503
+    "bandwidth": None,  # bytes per second per download, None is unthrottled
+    "max_pixels": 10000 * 10000,  # pixels per request before a memory limit error
+    "max_elements": None,  # features per getInfo before a memory limit error
+    "seed": 0,
+}
+COLLECTIONS = {}
+DEFAULT_COLLECTION = {"bands": None, "scale": 1000, "start": "2000-01-01", "end": "2030-01-01",
+                      "freq": "MS", "rasters": None}
+
+_random = random.Random(0)
+_lock = threading.Lock()
+_server = None
+
+
+class EEException(Exception):
+    pass
+
+
+class MockStats:
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.failures = {}
+        self.bytes = 0
+
+    def record(self, kind, size=0):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            self.bytes += size
+
+    def record_failure(self, kind):
+        with self._lock:
+            self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "failures": dict(self.failures), "bytes": self.bytes}
+
+
+STATS = MockStats()
+
+
+def configure(**kwargs):
+    unknown = sorted(set(kwargs) - set(CONFIG))
+    if unknown:
+        raise ValueError(f"unknown settings {unknown}, expected some of {sorted(CONFIG)}")
+    with _lock:
+        CONFIG.update(kwargs)
+        _random.seed(CONFIG["seed"])
+
+
+def register_collection(collection_id, bands=None, scale=1000, start="2000-01-01", end="2030-01-01",
+                        freq="MS", rasters=None):
+    # rasters: {date: GeoTIFF path} answered from local files instead of the synthetic field
+    COLLECTIONS[collection_id] = {"bands": bands, "scale": scale, "start": start, "end": end,
+                                  "freq": freq, "rasters": rasters}
+
+
+def Initialize(*args, **kwargs):
+    pass
+
+
+def ServiceAccountCredentials(*args, **kwargs):
+    return None
+
+
+def sleep_for(latency):
+    if isinstance(latency, (list, tuple)):
+        with _lock:
+            latency = _random.uniform(*latency)
+    if latency:
+        time.sleep(latency)
+
+
+def injected_failure(rate):
+    if not rate:
+        return False
+    with _lock:
+        return _random.random() < rate
+
+
+def rpc(kind):
+    STATS.record(kind)
+    sleep_for(CONFIG["rpc_latency"])
+    if injected_failure(CONFIG["rpc_failure_rate"]):
+        STATS.record_failure(kind)
+        raise EEException(f"Service unavailable (injected {kind} failure)")
+
+
+def check_size(pixels):
+    if CONFIG["max_pixels"] is not None and pixels > CONFIG["max_pixels"]:
+        raise EEException("User memory limit exceeded.")
+
+
+def resolve(value):
+    if isinstance(value, ComputedObject):
+        return resolve(value._value())
+    if isinstance(value, dict):
+        return {k: resolve(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [resolve(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class ComputedObject(abc.ABC):
+    @abc.abstractmethod
+    def _value(self):
+        # the plain python value getInfo returns
+        pass
+
+    def getInfo(self):
+        rpc("getInfo")
+        return resolve(self._value())
+
+
+class Value(ComputedObject):
+    def __init__(self, value):
+        self.value = value
+
+    def _value(self):
+        return self.value() if callable(self.value) else self.value
+
+
+class List(ComputedObject):
+    def __init__(self, values):
+        self.values = list(resolve(values)) if isinstance(values, ComputedObject) else list(values)
+
+    def map(self, fn):
+        return List([fn(v) for v in self.values])
+
+    def size(self):
+        return Value(len(self.values))
+
+    def _value(self):
+        return self.values
+
+
+class Dictionary(ComputedObject):
+    def __init__(self, values=None):
+        self.values = values if callable(values) else dict(values or {})
+
+    @staticmethod
+    def fromLists(keys, values):
+        return Dictionary(lambda: dict(zip(resolve(keys), resolve(values))))
+
+    def get(self, key):
+        return Value(lambda: resolve(self._value())[key])
+
+    def _value(self):
+        return self.values() if callable(self.values) else self.values
+
+
+class Date(ComputedObject):
+    def __init__(self, value):
+        if isinstance(value, Date):
+            value = value.timestamp
+        elif isinstance(value, (int, float)):
+            value = pd.Timestamp(value, unit="ms")
+        self.timestamp = pd.Timestamp(value)
+
+    def advance(self, delta, unit):
+        return Date(self.timestamp + pd.DateOffset(**{f"{unit}s": resolve(delta)}))
+
+    def format(self, fmt=None):
+        # the Joda patterns used in this repo
+        fmt = (fmt or "yyyy-MM-dd'T'HH:mm:ss").replace("'", "")
+        for joda, strf in (("YYYY", "%Y"), ("yyyy", "%Y"), ("MM", "%m"), ("dd", "%d"),
+                           ("HH", "%H"), ("mm", "%M"), ("ss", "%S")):
+            fmt = fmt.replace(joda, strf)
+        return self.timestamp.strftime(fmt)
+
+    def millis(self):
+        return Value(int(self.timestamp.value // 1_000_000))
+
+    def _value(self):
+        return {"type": "Date", "value": int(self.timestamp.value // 1_000_000)}
+
+
+class Projection(ComputedObject):
+    def __init__(self, scale, crs="EPSG:4326"):
+        self.scale = scale
+        self.crs_code = crs
+
+    def nominalScale(self):
+        return Value(self.scale)
+
+    def crs(self):
+        return Value(self.crs_code)
+
+    def _value(self):
+        return {"type": "Projection", "crs": self.crs_code, "nominalScale": self.scale}
+
+
+class Geometry(ComputedObject):
+    def __init__(self, geo_json):
+        self.geom = geo_json
+
+    @staticmethod
+    def BBox(west, south, east, north):
+        return Geometry(box(west, south, east, north))
+
+    def shapely(self):
+        geom = self.geom() if callable(self.geom) else self.geom
+        return geom if isinstance(geom, BaseGeometry) else shape(geom)
+
+    def bounds(self):
+        return Geometry(lambda: box(*self.shapely().bounds))
+
+    def _value(self):
+        return mapping(self.shapely())
+
+
+def to_shapely(region):
+    if isinstance(region, BaseGeometry):
+        return region
+    if isinstance(region, Geometry):
+        return region.shapely()
+    if isinstance(region, (Feature, FeatureCollection)):
+        return region.geometry().shapely()
+    return shape(region)
+
+
+class Feature(ComputedObject):
+    def __init__(self, geom, opt_properties=None, id=None):
+        if isinstance(geom, dict) and geom.get("type") == "Feature":
+            opt_properties = geom.get("properties")
+            id = geom.get("id", id)
+            geom = geom.get("geometry")
+        self.geom = to_shapely(geom) if geom is not None else None
+        self.properties = dict(opt_properties or {})
+        self.id = id
+
+    def set(self, *args):
+        properties = dict(self.properties)
+        properties.update(args[0] if len(args) == 1 else {args[0]: args[1]})
+        return Feature(self.geom, resolve(properties), self.id)
+
+    def get(self, key):
+        return Value(self.properties.get(key))
+
+    def propertyNames(self):
+        return List(["system:index"] + list(self.properties))
+
+    def toDictionary(self):
+        return Dictionary(self.properties)
+
+    def geometry(self):
+        return Geometry(self.geom)
+
+    def setGeometry(self, geom):
+        return Feature(geom, self.properties, self.id)
+
+    def _value(self):
+        return {"type": "Feature", "id": self.id,
+                "geometry": mapping(self.geom) if self.geom is not None else None,
+                "properties": self.properties}
+
+
+class FeatureCollection(ComputedObject):
+    def __init__(self, args):
+        # evaluated lazily, so the work happens inside getInfo like on the server
+        if isinstance(args, dict):
+            features = [Feature(f, id=f.get("id", str(i))) for i, f in enumerate(args["features"])]
+        elif isinstance(args, List):
+            features = args.values
+        elif isinstance(args, Feature):
+            features = [args]
+        else:
+            features = args
+        self._features = features
+
+    def features(self):
+        features = self._features() if callable(self._features) else self._features
+        return [f if isinstance(f, (Feature, FeatureCollection)) else Feature(f) for f in features]
+
+    def map(self, fn):
+        return FeatureCollection(lambda: [fn(f) for f in self.features()])
+
+    def flatten(self):
+        def features():
+            out = []
+            for i, collection in enumerate(self.features()):
+                for f in collection.features():
+                    out.append(Feature(f.geom, f.properties, f"{i}_{f.id}"))
+            return out
+        return FeatureCollection(features)
+
+    def select(self, propertySelectors, newProperties=None, retainGeometry=True):
+        patterns = [re.compile(p) for p in propertySelectors]
+
+        def features():
+            out = []
+            for f in self.features():
+                keys = [k for k in f.properties if any(p.fullmatch(k) for p in patterns)]
+                names = newProperties or keys
+                properties = {name: f.properties[k] for name, k in zip(names, keys)}
+                out.append(Feature(f.geom if retainGeometry else None, properties, f.id))
+            return out
+        return FeatureCollection(features)
+
+    def first(self):
+        return self.features()[0]
+
+    def size(self):
+        return Value(lambda: len(self.features()))
+
+    def geometry(self):
+        return Geometry(lambda: unary_union([f.geom for f in self.features() if f.geom is not None]))
+
+    def _value(self):
+        features = self.features()
+        if CONFIG["max_elements"] is not None and len(features) > CONFIG["max_elements"]:
+            raise EEException("User memory limit exceeded.")
+        return {"type": "FeatureCollection", "features": [f._value() for f in features]}
+
+
+class Reducer:
+    def __init__(self, names):
+
+        self.names = list(names)
+
+    @staticmethod
+    def mean():
+        return Reducer(["mean"])
+
+    @staticmethod
+    def median():
+        return Reducer(["median"])
+
+    @staticmethod
+    def sum():
+        return Reducer(["sum"])
+
+    @staticmethod
+    def min():
+        return Reducer(["min"])
+
+    @staticmethod
+    def max():
+        return Reducer(["max"])
+
+    @staticmethod
+    def count():
+        return Reducer(["count"])
+
+    @staticmethod
+    def stdDev():
+        return Reducer(["stdDev"])
+
+    @staticmethod
+    def variance():
+        return Reducer(["variance"])
+
+    def combine(self, reducer2, outputPrefix="", sharedInputs=False):
+        return Reducer(self.names + reducer2.names)
+
+
+def weighted_variance(v, w):
+    mean = np.sum(w * v) / np.sum(w)
+    return max(np.sum(w * v * v) / np.sum(w) - mean * mean, 0.0)
+
+
+# spatial statistics of the pixels in a region, weighted by pixel coverage like reduceRegions
+REGION_STATS = {
+    "mean": lambda v, w: np.sum(w * v) / np.sum(w),
+    "sum": lambda v, w: np.sum(w * v),
+    "variance": weighted_variance,
+    "stdDev": lambda v, w: math.sqrt(weighted_variance(v, w)),
+    "median": lambda v, w: np.median(v),
+    "min": lambda v, w: np.min(v),
+    "max": lambda v, w: np.max(v),
+    "count": lambda v, w: len(v),
+}
+# temporal statistics of an image stack
+STACK_STATS = {
+    "mean": np.nanmean,
+    "median": np.nanmedian,
+    "sum": np.nansum,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "stdDev": np.nanstd,
+    "variance": np.nanvar,
+    "count": lambda stack, axis: np.sum(~np.isnan(stack), axis=axis),
+}
+
+
+def grid_for_bounds(bounds, scale):
+    deg = scale / METERS_PER_DEGREE
+    minx, miny, maxx, maxy = bounds
+    width = max(1, int(math.ceil((maxx - minx) / deg)))
+    height = max(1, int(math.ceil((maxy - miny) / deg)))
+    return (minx, deg, 0, maxy, 0, -deg), width, height
+
+
+def pixel_centres(geo_t, width, height):
+    lon = geo_t[0] + (np.arange(width) + 0.5) * geo_t[1]
+    lat = geo_t[3] + (np.arange(height) + 0.5) * geo_t[5]
+    return np.meshgrid(lon, lat)
+
+
+def synthetic_band(name, when, geo_t, width, height):
+    # smooth deterministic field with a seasonal cycle, different for every band name
+    lon, lat = pixel_centres(geo_t, width, height)
+    phase = zlib.crc32(name.encode("utf-8")) % 360
+    season = math.sin(2 * math.pi * (when.month - 1) / 12 + math.radians(phase))
+    field = 50 + 25 * np.sin(np.radians(4 * lon + phase)) * np.cos(np.radians(4 * lat)) + 10 * season
+    return field.astype(np.float32)
+
+
+def raster_bands(path, names, geo_t, width, height):
+    bounds = (geo_t[0], geo_t[3] + height * geo_t[5], geo_t[0] + width * geo_t[1], geo_t[3])
+    ds = gdal.Warp("", path, format="MEM", dstSRS="EPSG:4326", outputBounds=bounds, width=width, height=height,
+                   outputType=gdal.GDT_Float32, resampleAlg="near", dstNodata=np.nan)
+    descriptions = [ds.GetRasterBand(i + 1).GetDescription() or f"b{i + 1}" for i in range(ds.RasterCount)]
+    out = []
+    for name in names:
+        if name not in descriptions:
+            raise EEException(f"Image.select: Pattern '{name}' did not match any bands.")
+        out.append(ds.GetRasterBand(descriptions.index(name) + 1).ReadAsArray().astype(np.float32))
+    ds = None
+    return np.stack(out)
+
+
+class Image(ComputedObject):
+    def __init__(self, bands, render, scale=1000, dtype="float32"):
+
+        # bands None accepts any band name (synthetic collections)
+        self.bands = bands
+        # render(names, geo_t, width, height) -> float32 (band, y, x), NaN where masked
+        self._render = render
+        self.scale = scale
+        self.dtype = dtype
+
+    def band_list(self, names=None):
+        if names is not None:
+            return [names] if isinstance(names, str) else list(names)
+        if self.bands is not None:
+            return list(self.bands)
+        return ["b1"]
+
+    def check_bands(self, names):
+        if not names:
+            raise EEException("Image has no bands.")
+        for name in names:
+            if self.bands is not None and name not in self.bands:
+                raise EEException(f"Image.select: Pattern '{name}' did not match any bands.")
+
+    def _value(self):
+        return {"type": "Image", "bands": [{"id": name, "data_type": {"type": "PixelType", "precision": self.dtype}}
+                                           for name in self.band_list()]}
+
+    def render(self, geo_t, width, height, names=None):
+        names = self.band_list(names)
+        check_size(width * height * len(names))
+        return self._render(names, geo_t, width, height)
+
+    def derive(self, fn, dtype=None):
+        return Image(self.bands, lambda names, *grid: fn(self._render(names, *grid)), self.scale,
+                     dtype or self.dtype)
+
+    def select(self, *selectors):
+        selectors = selectors[0] if len(selectors) == 1 and isinstance(selectors[0], (list, tuple)) else selectors
+        names = []
+        for selector in selectors:
+            if isinstance(selector, int):
+                selector = self.band_list()[selector]
+            if self.bands is not None and selector not in self.bands:
+                raise EEException(f"Image.select: Pattern '{selector}' did not match any bands.")
+            names.append(selector)
+        return Image(names, self._render, self.scale, self.dtype)
+
+    def multiply(self, value):
+        return self.derive(lambda a: a * value)
+
+    def gt(self, value):
+        return self.derive(lambda a: np.where(np.isnan(a), np.nan, (a > value).astype(np.float32)))
+
+    def toFloat(self):
+        return self.derive(lambda a: a, "float32")
+
+    def uint16(self):
+        return self.derive(lambda a: np.clip(np.floor(a), 0, 65535), "uint16")
+
+    def mask(self, mask=None):
+        if mask is not None:
+            return self.updateMask(mask)
+        return self.derive(lambda a: (~np.isnan(a)).astype(np.float32))
+
+    def updateMask(self, mask):
+        def render(names, *grid):
+            a = self._render(names, *grid)
+            m = mask._render(mask.band_list(), *grid)
+            return np.where((m == 0) | np.isnan(m), np.nan, a)
+        return Image(self.bands, render, self.scale, self.dtype)
+
+    def clip(self, region):
+        def render(names, geo_t, width, height):
+            outside = geometry_mask([mapping(to_shapely(region))], out_shape=(height, width),
+                                    transform=Affine.from_gdal(*geo_t))
+            a = self._render(names, geo_t, width, height)
+            a[:, outside] = np.nan
+            return a
+        return Image(self.bands, render, self.scale, self.dtype)
+
+    def projection(self):
+        return Projection(self.scale)
+
+    def bandNames(self):
+        return List(self.band_list())
+
+    def reduceRegions(self, collection, reducer, scale=None, crs=None, **kwargs):
+        scale = resolve(scale) or self.scale
+
+        def features():
+            features = collection.features()
+            geoms = [f.geom for f in features if f.geom is not None]
+            names = self.band_list()
+            if geoms and names:
+                bounds = np.array([g.bounds for g in geoms])
+                geo_t, width, height = grid_for_bounds(
+                    (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()), scale)
+                pixels = self.render(geo_t, width, height, names)
+
+            out = []
+            for f in features:
+                properties = dict(f.properties)
+                if f.geom is not None and names:
+                    indices, weights = zone_coverage(f.geom, geo_t, (height, width), SUPERSAMPLE)
+                    for k, band in enumerate(names):
+                        values = pixels[k].ravel()[indices]
+                        valid = ~np.isnan(values)
+                        for name in reducer.names:
+                            # same naming as the server: bare reducer names for a single band
+                            key = name if len(names) == 1 else f"{band}_{name}"
+                            properties[key] = float(REGION_STATS[name](values[valid], weights[valid])) \
+                                if valid.any() else None
+                out.append(Feature(f.geom, properties, f.id))
+            return out
+        return FeatureCollection(features)
+
+    def getDownloadUrl(self, params):
+        rpc("getDownloadUrl")
+        names = self.band_list(params.get("bands"))
+        image = self
+        if "crs_transform" in params and "dimensions" in params:
+            t = params["crs_transform"]
+            width, height = [int(d) for d in str(params["dimensions"]).split("x")]
+            geo_t = (t[2], t[0], t[1], t[5], t[3], t[4])
+        else:
+            geo_t, width, height = grid_for_bounds(to_shapely(params["region"]).bounds,
+                                                   params.get("scale") or self.scale)
+            image = self.clip(params["region"])
+        self.check_bands(names)
+        check_size(width * height * len(names))
+        return get_server().register(image, names, (geo_t, width, height))
+
+
+def collection_items(collection_id):
+    config = COLLECTIONS.get(collection_id, DEFAULT_COLLECTION)
+    scale = config["scale"]
+    if config["rasters"] is not None:
+        items = []
+        for when, path in sorted(config["rasters"].items()):
+            render = (lambda path: lambda names, *grid: raster_bands(path, names, *grid))(path)
+            items.append((pd.Timestamp(when), Image(config["bands"], render, scale)))
+        return items
+
+    end = pd.Timestamp(config["end"])
+    dates = [when for when in pd.date_range(config["start"], end, freq=config["freq"]) if when < end]
+
+    def image(when):
+        def render(names, *grid):
+            return np.stack([synthetic_band(name, when, *grid) for name in names])
+        return Image(config["bands"], render, scale)
+    return [(when, image(when)) for when in dates]
+
+
+class ImageCollection(ComputedObject):
+    def __init__(self, args):
+        # (timestamp, Image) pairs, from the registry for a collection id
+        self.items = collection_items(args) if isinstance(args, str) else list(args)
+
+    def _value(self):
+        features = [dict(image._value(), properties={"system:time_start": int(when.value // 1_000_000)})
+                    for when, image in self.items]
+        return {"type": "ImageCollection", "features": features}
+
+    def select(self, *selectors):
+        return ImageCollection([(when, image.select(*selectors)) for when, image in self.items])
+
+    def filterDate(self, start, end=None):
+        start = Date(start).timestamp
+        end = Date(end).timestamp if end is not None else start + pd.Timedelta(days=1)
+        return ImageCollection([(when, image) for when, image in self.items if start <= when < end])
+
+    def filterBounds(self, geometry):
+        return self
+
+    def map(self, fn):
+        return ImageCollection([(when, fn(image)) for when, image in self.items])
+
+    def first(self):
+        if not self.items:
+            return Image([], lambda names, geo_t, width, height: np.empty((0, height, width), np.float32))
+        return self.items[0][1]
+
+    def size(self):
+        return Value(len(self.items))
+
+    def aggregate_min(self, prop):
+        return Value(lambda: min(int(when.value // 1_000_000) for when, image in self.items))
+
+    def aggregate_max(self, prop):
+        return Value(lambda: max(int(when.value // 1_000_000) for when, image in self.items))
+
+    def stack(self, names, *grid):
+        return np.stack([image._render(names, *grid) for when, image in self.items])
+
+    def composite(self, name):
+        # median(), mean(), ... keep the band names; an empty window has no bands
+        first = self.first()
+
+        def render(names, *grid):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                return STACK_STATS[name](self.stack(names, *grid), axis=0).astype(np.float32)
+        return Image(first.bands if self.items else [], render, first.scale, first.dtype)
+
+    def median(self):
+        return self.composite("median")
+
+    def mean(self):
+        return self.composite("mean")
+
+    def sum(self):
+        return self.composite("sum")
+
+    def min(self):
+        return self.composite("min")
+
+    def max(self):
+        return self.composite("max")
+
+    def reduce(self, reducer):
+        # one output band per input band and reducer, named <band>_<reducer>
+        first = self.first()
+        bands = [f"{band}_{name}" for band in first.band_list() for name in reducer.names] if self.items else []
+
+        def render(names, *grid):
+            stacks = {}
+            out = []
+            for output in names:
+                band, name = output.rsplit("_", 1)
+                if band not in stacks:
+                    stacks[band] = self.stack([band], *grid)[:, 0]
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    out.append(STACK_STATS[name](stacks[band], axis=0).astype(np.float32))
+            return np.stack(out)
+        return Image(bands, render, first.scale)
+
+
+def compute_pixels(params):
+    rpc("computePixels")
+    image = params["expression"]
+    grid = params["grid"]
+    width = grid["dimensions"]["width"]
+    height = grid["dimensions"]["height"]
+    t = grid["affineTransform"]
+    geo_t = (t["translateX"], t["scaleX"], t["shearX"], t["translateY"], t["shearY"], t["scaleY"])
+    names = image.band_list(params.get("bandIds"))
+    image.check_bands(names)
+    array = image.render(geo_t, width, height, names)
+
+    # NPY payload: one structured field per band, as the server returns it
+    dtype = np.uint16 if image.dtype == "uint16" else np.float32
+    out = np.zeros((height, width), dtype=[(name, dtype) for name in names])
+    for k, name in enumerate(names):
+        out[name] = np.nan_to_num(array[k], nan=0) if dtype is np.uint16 else array[k]
+    buffer = io.BytesIO()
+    np.save(buffer, out)
+    return buffer.getvalue()
+
+
+class data:
+    computePixels = staticmethod(compute_pixels)
+
+
+def render_geotiff(image, names, grid):
+    geo_t, width, height = grid
+    array = image.render(geo_t, width, height, names)
+    uint16 = image.dtype == "uint16"
+    path = f"/vsimem/mock_ee_{uuid.uuid4().hex}.tif"
+    ds = gdal.GetDriverByName("GTiff").Create(path, width, height, len(names),
+                                              gdal.GDT_UInt16 if uint16 else gdal.GDT_Float32,
+                                              ["TILED=YES", "COMPRESS=DEFLATE"])
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetGeoTransform(geo_t)
+    ds.SetProjection(srs.ExportToWkt())
+    for k, name in enumerate(names):
+        band = ds.GetRasterBand(k + 1)
+        band.SetDescription(name)
+        band.WriteArray(np.nan_to_num(array[k], nan=0) if uint16 else array[k])
+    ds = None
+
+    fd = gdal.VSIFOpenL(path, "rb")
+    size = gdal.VSIStatL(path).size
+    body = gdal.VSIFReadL(1, size, fd)
+    gdal.VSIFCloseL(fd)
+    gdal.Unlink(path)
+    return body
+
+
+class DownloadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        sleep_for(CONFIG["http_latency"])
+        token = self.path.rsplit("/", 1)[-1]
+        if token not in self.server.jobs:
+            self.send_error(404)
+            return
+        if injected_failure(CONFIG["http_failure_rate"]):
+            # the job is kept, a retry of the same URL succeeds
+            STATS.record_failure("download")
+            self.send_error(503)
+            return
+        # served once, so the image graph is not kept alive for the rest of the run
+        job = self.server.jobs.pop(token, None)
+        if job is None:
+            self.send_error(404)
+            return
+        try:
+            body = render_geotiff(*job)
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        chunk = 256 * 1024
+        for i in range(0, len(body), chunk):
+            self.wfile.write(body[i:i + chunk])
+            if CONFIG["bandwidth"]:
+                time.sleep(min(chunk, len(body) - i) / CONFIG["bandwidth"])
+        STATS.record("download", len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+MAX_PENDING_JOBS = 4096  # registered download URLs not fetched yet
+
+
+class MockServer:
+    def __init__(self, host="127.0.0.1", port=0):
+
+        # getDownloadUrl registers a job, the GeoTIFF is rendered when the URL is fetched
+        self.httpd = ThreadingHTTPServer((host, port), DownloadHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.jobs = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def register(self, image, names, grid):
+        token = uuid.uuid4().hex
+        with self.lock:
+            # URLs that are never fetched are dropped oldest first
+            while len(self.httpd.jobs) >= MAX_PENDING_JOBS:
+                self.httpd.jobs.pop(next(iter(self.httpd.jobs)), None)
+            self.httpd.jobs[token] = (image, names, grid)
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/download/{token}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def get_server():
+    global _server
+    with _lock:
+        if _server is None:
+            _server = MockServer()
+        return _server
+
+
+def shutdown():
+    global _server
+    with _lock:
+        if _server is not None:
+            _server.close()
+            _server = None
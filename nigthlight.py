@@ -10,23 +10,32 @@ import os
 from osgeo import gdal
 import ee
 import pandas as pd
-import geopandas as gpd
 import json
-from multiprocessing import Pool
+from functools import partial
 from sklearn.preprocessing  import minmax_scale
 from datetime import timedelta
 import datetime
+import ee_backend
+from tile_downloader import TileDownloader, init_ee
+from download_manifest import DownloadManifest
+from http_download import download_to_file, get_session, STATS
+from boundary_store import get_boundaries
+from collection_metadata import get_scale
+from parallel_warp import warp_parallel
+from raster_io import cog_options, to_cog
+import tracing
+from tracing import file_size, span, traced
 
 
 
-def writeGeoTiff_v3(npArray,geoTrans,outpath,dataType,wkt,MEM):
+def writeGeoTiff_v3(npArray,geoTrans,outpath,dataType,wkt,MEM,cog=False,block_size=512):
 
-    if (MEM == 1):
+    if (MEM == 1 or cog):
         driver = gdal.GetDriverByName('MEM')
     else:
         driver = gdal.GetDriverByName('GTiff')
     dataset = driver.Create(
-         outpath,
+         '' if cog else outpath,
          npArray.shape[1],
          npArray.shape[0],
          1,
@@ -43,12 +52,16 @@ def writeGeoTiff_v3(npArray,geoTrans,outpath,dataType,wkt,MEM):
 
     dataset.FlushCache()
 
+    if cog:
+        # tiled, overview-bearing cloud optimized GeoTIFF built from the in-memory copy
+        gdal.Translate(outpath, dataset, format="COG", creationOptions=cog_options(dataType, block_size))
+        dataset = gdal.Open(outpath, gdal.GA_ReadOnly)
+
     return dataset
 
 
-def warp_and_match_resolution(in_path,out_path,match_file):
+def warp_and_match_resolution(in_path,out_path,match_file,parallel=False,max_workers=None):
     # Resample with GDAL warp
-    source_image_metadata = gdal.Open(in_path,gdal.GA_ReadOnly)
     source_match=gdal.Open(match_file,gdal.GA_ReadOnly)
 
     geo_t = source_match.GetGeoTransform()
@@ -60,20 +73,26 @@ def warp_and_match_resolution(in_path,out_path,match_file):
     ymax = max(geo_t[3], geo_t[3] + y_size * geo_t[5])
 
     try:
-        gdal.Warp(out_path,
-                          in_path,
-                          dstSRS='EPSG:4326',
-                          outputType=gdal.GDT_UInt16,
-                          xRes=source_match.GetGeoTransform()[1], yRes=source_match.GetGeoTransform()[1],
-                          resampleAlg="average",
-                          options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
-                          )
+        with span("gdal_warp") as trace:
+            if parallel:
+                # windowed warp on a process pool, assembled into a COG
+                warp_parallel(in_path, out_path, (xmin, ymin, xmax, ymax), geo_t[1], max_workers=max_workers)
+            else:
+                gdal.Warp(out_path,
+                                  in_path,
+                                  dstSRS='EPSG:4326',
+                                  outputType=gdal.GDT_UInt16,
+                                  xRes=source_match.GetGeoTransform()[1], yRes=source_match.GetGeoTransform()[1],
+                                  resampleAlg="average",
+                                  options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
+                                  )
+            trace["bytes"] = file_size(out_path)
 
         return True
     except Exception as e:
         print(e)
 
-def warp_to_resolution(in_path,out_path,resolution):
+def warp_to_resolution(in_path,out_path,resolution,parallel=False,max_workers=None):
     # Resample with GDAL warp
     source_image_metadata = gdal.Open(in_path,gdal.GA_ReadOnly)
     geo_t = source_image_metadata.GetGeoTransform()
@@ -91,14 +110,19 @@ def warp_to_resolution(in_path,out_path,resolution):
 
 
     try:
-        gdal.Warp(out_path,
-                          in_path,
-                          dstSRS='EPSG:4326',
-                          outputType=gdal.GDT_UInt16,
-                          xRes=resolution, yRes=resolution,
-                          resampleAlg="average",
-                          options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
-                          )
+        with span("gdal_warp") as trace:
+            if parallel:
+                warp_parallel(in_path, out_path, (xmin, ymin, xmax, ymax), resolution, max_workers=max_workers)
+            else:
+                gdal.Warp(out_path,
+                                  in_path,
+                                  dstSRS='EPSG:4326',
+                                  outputType=gdal.GDT_UInt16,
+                                  xRes=resolution, yRes=resolution,
+                                  resampleAlg="average",
+                                  options=['-te', str(xmin), str(ymin), str(xmax), str(ymax)]
+                                  )
+            trace["bytes"] = file_size(out_path)
 
 
         return True
@@ -106,15 +130,14 @@ def warp_to_resolution(in_path,out_path,resolution):
         print(e)
 
 
+@traced("getArea")
 def getArea(GID_0,LEVEL_AGG):
-    area = gpd.read_file(f'reference_datasets/gadm_401_GID_1/{GID_0[0:3]}.gpkg')
     if LEVEL_AGG == "GID_0":
-        area = area.dissolve("GID_0").reset_index()
+        area = get_boundaries(GID_0[0:3], "GID_0")
         area.drop(columns=['GID_1', 'NAME_1'], axis=1, inplace=True )
 
     if LEVEL_AGG == "GID_1":
-        area = area.loc[area.GID_1 == GID_0]
-        area = area.dissolve("GID_1").reset_index()
+        area = get_boundaries(GID_0, "GID_1")
         area.drop(columns=['GID_0', 'NAME_0'], axis=1, inplace=True )
 
 
@@ -123,71 +146,111 @@ def getArea(GID_0,LEVEL_AGG):
 
 
 
-def get_image_url(image,bands,scale,region):
-    import requests
+def get_download_url(image,bands,scale,region):
+    with span("getDownloadUrl"):
+        path = image.getDownloadUrl({
+            'bands': bands,
+            'scale': scale,
+            'crs': "EPSG:4326",
+            'region': region,
+            'format': 'GEO_TIFF'
+        })
+    return path
 
 
-    path = image.getDownloadUrl({
-        'bands': bands,
-        'scale': scale,
-        'crs': "EPSG:4326",
-        'region': region,
-        'format': 'GEO_TIFF'
-    })
+def get_image_url(image,bands,scale,region,downloader=None):
+    path = get_download_url(image, bands, scale, region)
 
-    response = requests.get(path)
+    with span("http_download") as trace:
+        if downloader is not None:
+            response = downloader.get(path)
+        else:
+            response = get_session().get(path)
+        trace["bytes"] = len(response.content)
     return response
 
 
-def process(el):
-    lon, lat, lon_lon_steps, lat_lat_steps, startDate, endDate, year, quarter,basepath,email,keypath = el
+def get_image_to_file(image,bands,scale,region,out_path,downloader=None,atomic=True):
+    path = get_download_url(image, bands, scale, region)
 
-    basepath = f"{basepath}/{year}/{quarter}/"
-    if not os.path.exists(basepath):
-        os.makedirs(basepath)
+    if downloader is not None:
+        return downloader.download(path, out_path, atomic=atomic)
+    return download_to_file(path, out_path, atomic=atomic)
 
-    credentials = ee.ServiceAccountCredentials(
-        email,
-        keypath,
-    )
-    ee.Initialize(credentials)
 
+def get_tile_to_file(bbox,startDate,endDate,out_path,SCALE=None,downloader=None,atomic=True):
+    region = ee.Geometry.BBox(*bbox)
 
-    numtile = "_".join(map(str,[lon,lat]))
-    filename = f"{basepath}/tile_{numtile}.tif"
+    bands = ["avg_rad"]
 
-    if not os.path.exists(filename):
-        region = ee.Geometry.BBox(el[0], el[1], el[2], el[3])
+    mycollection = ee.ImageCollection("NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG")
+    if SCALE is None:
+        SCALE = get_scale("NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG", "avg_rad")
 
-        bands = ["avg_rad"]
+    image = mycollection.filterDate(startDate, endDate)
 
-        mycollection = ee.ImageCollection("NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG")
-        SCALE = mycollection.first().projection().nominalScale().getInfo()
+    # in case we want to filter by images with confidence
+    def filterConfidence(image):
+        mask = image.select('cf_cvg').gt(1)
+        return image.updateMask(mask)
+    image = image.map(filterConfidence)
 
-        image = mycollection.filterDate(startDate, endDate)
 
-        # in case we want to filter by images with confidence
-        def filterConfidence(image):
-            mask = image.select('cf_cvg').gt(1)
-            return image.updateMask(mask)
-        image = image.map(filterConfidence)
+    image = image.mean().multiply(10000).uint16()
 
+    return get_image_to_file(image, bands, SCALE, region, out_path, downloader, atomic=atomic)
 
-        image = image.mean().multiply(10000).uint16()
 
+def process(el,SCALE=None,downloader=None,manifest=None,cog=False):
+    lon, lat, lon_lon_steps, lat_lat_steps, startDate, endDate, year, quarter,basepath,email,keypath = el
 
-        response = get_image_url(image, bands, SCALE, region)
+    basepath = f"{basepath}/{year}/{quarter}/"
+    if not os.path.exists(basepath):
+        os.makedirs(basepath)
 
-        with open(filename, 'wb') as fd:
-            fd.write(response.content)
 
-def downlaodtiles(basepath,email,keypath):
+    numtile = "_".join(map(str,[lon,lat]))
+    filename = f"{basepath}/tile_{numtile}.tif"
+
+    bbox = el[0:4]
+    if manifest is None:
+        init_ee(email, keypath)
+        if not os.path.exists(filename):
+            get_tile_to_file(bbox, startDate, endDate, filename, SCALE, downloader)
+            if cog:
+                to_cog(filename)
+        return
+
+    key = manifest.key(bbox, startDate, endDate)
+    if manifest.is_done(key, filename):
+        return
+    if os.path.exists(filename):
+        # files from before the manifest are kept when valid, an invalid one is removed and fetched again
+        if manifest.status(key) is not None or manifest.adopt_existing(key, bbox, startDate, endDate, filename):
+            return
+
+    # download next to the target and rename only once the GeoTIFF validates;
+    # .part is the only staging file, so the download writes it directly
+    tmp_filename = f"{filename}.part"
+    try:
+        init_ee(email, keypath)
+        get_tile_to_file(bbox, startDate, endDate, tmp_filename, SCALE, downloader, atomic=False)
+        if cog:
+            to_cog(tmp_filename)
+        manifest.commit_file(key, bbox, startDate, endDate, tmp_filename, filename)
+    except Exception as e:
+        # from the EE request to the COG conversion, the row never stays pending
+        manifest.mark_failed(key, bbox, startDate, endDate, filename, e)
+        raise
+    finally:
+        # left over when the download, the COG conversion or the validation failed
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def downlaodtiles(basepath,email,keypath,max_workers=16,max_per_host=8,manifest_path=None,cog=False,
+                  start_date="2012-01-01",end_date="2024-01-01",bounds=(-185,-75,180,85),lon_steps=5,lat_steps=5):
 
     list_of_bbox=[]
-    lon_steps = 5
-    lat_steps = 5
-    start_date = "2012-01-01"
-    end_date = "2024-01-01"
     dates = pd.date_range(start_date, end_date, freq='Q')
     dates_plus=[]
     for date in dates:
@@ -199,14 +262,30 @@ def downlaodtiles(basepath,email,keypath):
             endDate = dates_plus[i+1].strftime('%Y-%m-%d')
             quarter = f"Q{dates_plus[i].quarter}"
             year = dates_plus[i].year
-            for lon in range(-185,180,lon_steps):
-                for lat in range(-75,85,lat_steps):
+            for lon in range(bounds[0],bounds[2],lon_steps):
+                for lat in range(bounds[1],bounds[3],lat_steps):
                     list_of_bbox.append([lon, lat, lon+lon_steps, lat+lat_steps, startDate, endDate,year, quarter,basepath,email,keypath])
 
-    with Pool(100) as p:
-        p.map(process, list_of_bbox)
+    # initialise once and fetch the scale once, then share them with the worker threads
+    init_ee(email, keypath)
+    SCALE = get_scale("NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG", "avg_rad")
+
+    # the manifest keeps track of finished tiles so a rerun only fetches missing or failed ones
+    if manifest_path is None:
+        manifest_path = f"{basepath}/manifest.sqlite"
+    manifest = DownloadManifest(manifest_path)
+
+    downloader = TileDownloader(max_workers=max_workers, max_per_host=max_per_host)
+    downloader.map(partial(process, SCALE=SCALE, downloader=downloader, manifest=manifest, cog=cog), list_of_bbox)
+
+    print(manifest.summary())
+    print(STATS.summary())
+    print(tracing.summary())
+    manifest.close()
 
 if __name__ == "__main__":
+    ee_backend.use_env_backend()
+
     basepath = "DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/"
     email = "test1-landsat8@geelandsat8.iam.gserviceaccount.com"
     keypath = "mykey.json"
@@ -218,14 +297,22 @@ if __name__ == "__main__":
     #import subprocess
     #result = subprocess.run(['gdalbuildvrt','-vrtnodata 0', 'D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/*.tif', 'D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/index.vrt'])
 
+    # the global mosaic does not fit in memory, export it to XYZ window by window:
+    #from raster_io import geotiff_to_xyz
+    #geotiff_to_xyz("D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/index.vrt", "D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/index_xyz.parquet.gzip", stream=True)
+
     # Because the input has 500m resoultion and we want to match the worldpop, it is required to warp
     #in_path = "D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/index.vrt"
     #out_path = "D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/2012-04-01_2023-09-01_NOAA-VIIRS-DNB-MONTHLY_V1-VCMCFG.tif"
     #match_file = "D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/ppp_2020_1km_Aggregated.tif"
-    #warp_and_match_resolution(in_path, out_path, match_file)
+    #warp_and_match_resolution(in_path, out_path, match_file, parallel=True)
 
     # to minmax
     #out_path_minmax = "D:/DATA/NIGHTLIGHT/NOAA_VIIRS_DNB_MONTHLY_V1_VCMCFG/tiles/2012-04-01_2023-09-01_NOAA-VIIRS-DNB-MONTHLY_V1-VCMCFG_minmax.tif"
+    # streamed block by block so the global raster never has to fit in memory:
+    #from raster_io import minmax_normalise
+    #minmax_normalise(out_path, out_path_minmax)
+    # previous in-memory version:
     #source_image_metadata = gdal.Open(out_path, gdal.GA_ReadOnly)
     #geo_t = source_image_metadata.GetGeoTransform()
     #wkt = source_image_metadata.GetProjection()
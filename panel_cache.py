@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+from tracing import file_size, span
+
+
+CACHE_DIR = os.environ.get("GEE_PANEL_CACHE", os.path.expanduser("~/.cache/gee_demo/panels"))
+DEFAULT_TTL = 30 * 24 * 3600
+CACHE_VERSION = 1
+
+
+def request_hash(request):
+    # canonical JSON of the request, the date window is not part of it so longer ranges reuse entries
+    canonical = json.dumps(dict(request, version=CACHE_VERSION), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+class PanelCache:
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL):
+
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.ttl = ttl
+
+    def entry_dir(self, key):
+        return f"{self.cache_dir}/{key}"
+
+    def entry_path(self, key, interval_start):
+        return f"{self.entry_dir(key)}/{pd.Timestamp(interval_start).strftime('%Y%m%d%H%M%S')}.parquet"
+
+    def is_fresh(self, path):
+        if not os.path.exists(path):
+            return False
+        return self.ttl is None or time.time() - os.path.getmtime(path) < self.ttl
+
+    def read(self, key, interval_start):
+        path = self.entry_path(key, interval_start)
+        if not self.is_fresh(path):
+            return None
+        return pd.read_parquet(path)
+
+    def write(self, key, interval_start, df, request=None):
+        entry_dir = self.entry_dir(key)
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir)
+        if request is not None and not os.path.exists(f"{entry_dir}/request.json"):
+            with open(f"{entry_dir}/request.json", "w") as fd:
+                json.dump(request, fd, sort_keys=True, indent=1)
+
+        path = self.entry_path(key, interval_start)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with span("parquet_write") as trace:
+            df.to_parquet(tmp_path, index=False)
+            trace["bytes"] = file_size(tmp_path)
+        os.replace(tmp_path, path)
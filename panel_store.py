@@ -0,0 +1,49 @@
+import glob
+import os
+import shutil
+import pandas as pd
+from tracing import file_size, span
+
+
+# one hive partition per interval: <store>/interval_start=YYYY-MM-DD/part-0.parquet
+PARTITION_KEY = "interval_start"
+
+
+def partition_dir(store_dir, interval_start):
+    return f"{store_dir}/{PARTITION_KEY}={pd.Timestamp(interval_start).strftime('%Y-%m-%d')}"
+
+
+def list_intervals(store_dir):
+    # the partition names are enough, no data file has to be opened
+    starts = []
+    for path in glob.glob(f"{store_dir}/{PARTITION_KEY}=*"):
+        if os.path.exists(f"{path}/part-0.parquet"):
+            starts.append(pd.Timestamp(os.path.basename(path).split("=", 1)[1]))
+    return sorted(starts)
+
+
+def last_interval_start(store_dir):
+    starts = list_intervals(store_dir)
+    return starts[-1] if starts else None
+
+
+def write_interval(store_dir, interval_start, df):
+    # write into a temporary directory and rename, a crash never leaves a half partition
+    out_dir = partition_dir(store_dir, interval_start)
+    tmp_dir = f"{store_dir}/.tmp-{os.path.basename(out_dir)}-{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    with span("parquet_write") as trace:
+        df.to_parquet(f"{tmp_dir}/part-0.parquet", index=False)
+        trace["bytes"] = file_size(f"{tmp_dir}/part-0.parquet")
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+def read_store(store_dir):
+    df = pd.read_parquet(store_dir)
+    df[PARTITION_KEY] = pd.to_datetime(df[PARTITION_KEY].astype(str))
+    return df.sort_values(PARTITION_KEY, kind="stable").reset_index(drop=True)
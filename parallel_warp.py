@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from osgeo import gdal
+from raster_io import cog_options
+
+
+def init_worker(cache_mb):
+    gdal.UseExceptions()
+    gdal.SetCacheMax(cache_mb * 1024 * 1024)
+
+
+def plan_windows(bounds, xres, yres, window_px=4096):
+    # windows on the target pixel grid, so each one warps exactly like the full run would
+    xmin, ymin, xmax, ymax = bounds
+    width = int(round((xmax - xmin) / xres))
+    height = int(round((ymax - ymin) / yres))
+    windows = []
+    for row in range(0, height, window_px):
+        for col in range(0, width, window_px):
+            w = min(window_px, width - col)
+            h = min(window_px, height - row)
+            windows.append((xmin + col * xres, ymax - (row + h) * yres, xmin + (col + w) * xres, ymax - row * yres))
+    return windows
+
+
+def warp_window(job):
+    in_path, out_path, window, xres, yres, output_type, resample_alg, threads = job
+    start = time.perf_counter()
+    gdal.Warp(out_path,
+              in_path,
+              dstSRS='EPSG:4326',
+              outputType=output_type,
+              xRes=xres, yRes=yres,
+              resampleAlg=resample_alg,
+              outputBounds=window,
+              multithread=True,
+              warpOptions=[f'NUM_THREADS={threads}'],
+              creationOptions=['TILED=YES', 'COMPRESS=LZW']
+              )
+    seconds = time.perf_counter() - start
+    pixels = round((window[2] - window[0]) / xres) * round((window[3] - window[1]) / yres)
+    return out_path, seconds, pixels
+
+
+def warp_parallel(in_path, out_path, bounds, xres, yres=None, output_type=gdal.GDT_UInt16,
+                  resample_alg="average", window_px=4096, max_workers=None, threads_per_window=2,
+                  cache_mb=512):
+    yres = yres or xres
+    windows = plan_windows(bounds, xres, yres, window_px)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_path)))
+    jobs = [(in_path, f"{tmp_dir}/window_{i}.tif", window, xres, yres, output_type, resample_alg, threads_per_window)
+            for i, window in enumerate(windows)]
+
+    try:
+        window_files = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(cache_mb,)) as pool:
+            futures = [pool.submit(warp_window, job) for job in jobs]
+            for future in as_completed(futures):
+                window_file, seconds, pixels = future.result()
+                window_files.append(window_file)
+                print(f"{os.path.basename(window_file)}: {seconds:.1f}s, {pixels / seconds / 1e6:.2f} Mpx/s")
+
+        # assemble the windows into one tiled, compressed cloud optimized GeoTIFF
+        vrt_file = f"{tmp_dir}/mosaic.vrt"
+        gdal.BuildVRT(vrt_file, sorted(window_files))
+        gdal.Translate(out_path, vrt_file, format="COG", creationOptions=cog_options(output_type))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return True
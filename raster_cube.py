@@ -0,0 +1,158 @@
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import ee
+import numpy as np
+import pandas as pd
+import zarr
+from osgeo import gdal
+from auto_tiler import scale_to_degrees
+from http_download import download_to_file
+from tracing import span
+
+
+def plan_grid(bounds, scale_deg):
+    # fixed grid for every interval so the slices line up without resampling
+    minx, miny, maxx, maxy = bounds
+    width = int(math.ceil((maxx - minx) / scale_deg))
+    height = int(math.ceil((maxy - miny) / scale_deg))
+    transform = [scale_deg, 0, minx, 0, -scale_deg, maxy]
+    x = minx + (np.arange(width) + 0.5) * scale_deg
+    y = maxy - (np.arange(height) + 0.5) * scale_deg
+    return transform, width, height, x, y
+
+
+def interval_windows(startDate, endDate, intervalUnit="month", timeWindowLength=1):
+    windows = []
+    start = pd.Timestamp(startDate)
+    end = pd.Timestamp(endDate)
+    while start < end:
+        next_start = start + pd.DateOffset(**{f"{intervalUnit}s": timeWindowLength})
+        windows.append((start, min(next_start, end)))
+        start = next_start
+    return windows
+
+
+TEMPORAL_REDUCERS = ("median", "mean", "sum")
+
+
+def window_images(collection, start, end):
+    return collection.filterDate(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+
+def temporal_composite(collection, start, end, temporal_reducer):
+    images = window_images(collection, start, end)
+    if temporal_reducer == "mean":
+        return images.mean()
+    if temporal_reducer == "sum":
+        return images.sum()
+    if temporal_reducer == "median":
+        return images.median()
+    raise ValueError(f"unknown temporal_reducer {temporal_reducer!r}, expected one of {TEMPORAL_REDUCERS}")
+
+
+def window_sizes(collection, windows):
+    # image count of every window in one getInfo round trip
+    with span("getInfo"):
+        return ee.List([window_images(collection, start, end).size() for start, end in windows]).getInfo()
+
+
+class CubeWriter:
+    def __init__(self, out_path, times, bands, x, y, chunk=512):
+
+        # zarr v2 layout with the _ARRAY_DIMENSIONS convention so xarray.open_zarr reads it lazily
+        self.out_path = out_path
+        self.group = zarr.open_group(out_path, mode="w")
+        self.data = self.group.create_dataset(
+            "data", shape=(len(times), len(bands), len(y), len(x)),
+            chunks=(1, 1, min(chunk, len(y)), min(chunk, len(x))),
+            dtype="float32", fill_value=np.nan)
+        self.data.attrs["_ARRAY_DIMENSIONS"] = ["time", "band", "y", "x"]
+
+        days = ((pd.DatetimeIndex(times) - pd.Timestamp("1970-01-01")) / pd.Timedelta(days=1)).values
+        coords = {
+            "time": np.asarray(days, dtype="float64"),
+            "band": np.asarray(bands, dtype="U"),
+            "y": np.asarray(y, dtype="float64"),
+            "x": np.asarray(x, dtype="float64"),
+        }
+        for name, values in coords.items():
+            array = self.group.create_dataset(name, shape=values.shape, dtype=values.dtype)
+            array[:] = values
+            array.attrs["_ARRAY_DIMENSIONS"] = [name]
+        self.group["time"].attrs["units"] = "days since 1970-01-01"
+        self.group["time"].attrs["calendar"] = "proleptic_gregorian"
+        self.group.attrs["crs"] = "EPSG:4326"
+
+    def write(self, t, array):
+        self.data[t] = array
+
+    def close(self):
+        zarr.consolidate_metadata(self.out_path)
+
+
+def read_slice(path):
+    ds = gdal.Open(path, gdal.GA_ReadOnly)
+    array = ds.ReadAsArray().astype(np.float32)
+    if array.ndim == 2:
+        array = array[np.newaxis]
+    for i in range(ds.RasterCount):
+        nodata = ds.GetRasterBand(i + 1).GetNoDataValue()
+        if nodata is not None:
+            array[i][array[i] == nodata] = np.nan
+    ds = None
+    return array
+
+
+def download_cube(collection_id, bands, region, bounds, startDate, endDate, out_path, scale,
+                  intervalUnit="month", timeWindowLength=1, temporal_reducer="median",
+                  chunk=512, max_workers=4):
+    # one composite per interval, written into the (time, band, y, x) cube as soon as it arrives
+    if temporal_reducer not in TEMPORAL_REDUCERS:
+        raise ValueError(f"unknown temporal_reducer {temporal_reducer!r}, expected one of {TEMPORAL_REDUCERS}")
+    windows = interval_windows(startDate, endDate, intervalUnit, timeWindowLength)
+    transform, width, height, x, y = plan_grid(bounds, scale_to_degrees(scale))
+    writer = CubeWriter(out_path, [start for start, end in windows], bands, x, y, chunk)
+    collection = ee.ImageCollection(collection_id).select(bands)
+    # windows without images stay NaN; they are known up front, so any fetch error is a real failure
+    sizes = window_sizes(collection, windows)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_path)))
+
+    def fetch(t):
+        start, end = windows[t]
+        image = temporal_composite(collection, start, end, temporal_reducer).clip(region).toFloat()
+        with span("getDownloadUrl"):
+            path = image.getDownloadUrl({
+                'bands': bands,
+                'crs': "EPSG:4326",
+                'crs_transform': transform,
+                'dimensions': f"{width}x{height}",
+                'format': 'GEO_TIFF'
+            })
+        tmp_file = f"{tmp_dir}/slice_{t}.tif"
+        download_to_file(path, tmp_file)
+        return t, tmp_file
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(fetch, t) for t in range(len(windows)) if sizes[t] > 0]
+            try:
+                for future in as_completed(futures):
+                    t, tmp_file = future.result()
+                    writer.write(t, read_slice(tmp_file))
+                    os.remove(tmp_file)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        writer.close()
+    except BaseException:
+        # a failed window would otherwise be indistinguishable from an empty one
+        shutil.rmtree(out_path, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return out_path
@@ -0,0 +1,233 @@
+import io
+import math
+import os
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tracing import file_size, span
+
+
+XYZ_NODATA = -999
+ROW_GROUP_ROWS = 1024 * 1024  # rows per parquet row group of the streamed XYZ export
+
+
+def window_to_xyz(array, geo_t, nodata, x_off, y_off, raster_x_size):
+    # mask NaN, the band nodata and the -999 fill value in a single pass
+    mask = np.ones(array.shape, dtype=bool)
+    if np.issubdtype(array.dtype, np.floating):
+        mask &= ~np.isnan(array)
+    if nodata is not None and not np.isnan(nodata):
+        mask &= array != nodata
+    mask &= array != XYZ_NODATA
+
+    rows, cols = np.nonzero(mask)
+    values = array[rows, cols]
+    rows = rows + y_off
+    cols = cols + x_off
+
+    # pixel centres, same convention as the GDAL XYZ driver
+    lon = geo_t[0] + (cols + 0.5) * geo_t[1] + (rows + 0.5) * geo_t[2]
+    lat = geo_t[3] + (cols + 0.5) * geo_t[4] + (rows + 0.5) * geo_t[5]
+
+    if np.issubdtype(values.dtype, np.integer):
+        values = values.astype(np.int64)
+    else:
+        values = values.astype(np.float64).round(4)
+
+    # keep the row number the XYZ csv used to carry as index
+    index = rows.astype(np.int64) * raster_x_size + cols
+    xyz = pd.DataFrame({"lat": lat.round(2), "lon": lon.round(2), "value": values},
+                       index=index)
+    return xyz
+
+
+def npy_to_array(buffer):
+    # parse the .npy header and return a read-only view on the payload, the pixels are not copied
+    stream = io.BytesIO(buffer)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    count = math.prod(shape)
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=stream.tell())
+    return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def iter_windows(ds, window_size=None):
+    # walk the raster in windows aligned to the GDAL block layout (tiles or strips)
+    x_size = ds.RasterXSize
+    y_size = ds.RasterYSize
+    if window_size is None:
+        block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+        window_size = (x_size, block_y) if block_x >= x_size else (block_x, block_y)
+    win_x, win_y = window_size
+
+    for y_off in range(0, y_size, win_y):
+        for x_off in range(0, x_size, win_x):
+            yield x_off, y_off, min(win_x, x_size - x_off), min(win_y, y_size - y_off)
+
+
+def geotiff_to_xyz_streaming(in_geotiff, out_xyz_path, window_size=None, row_group_rows=ROW_GROUP_ROWS):
+    # windows are buffered into row groups of about row_group_rows rows, so memory is
+    # bounded by one row group while the file does not end up with a row group per block
+    ds = gdal.Open(in_geotiff, gdal.GA_ReadOnly)
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    geo_t = ds.GetGeoTransform()
+
+    writer = None
+    tables = []
+    rows = 0
+    for x_off, y_off, x_size, y_size in iter_windows(ds, window_size):
+        array = band.ReadAsArray(x_off, y_off, x_size, y_size)
+        xyz = window_to_xyz(array, geo_t, nodata, x_off, y_off, ds.RasterXSize)
+        if xyz.empty and writer is not None:
+            continue
+        table = pa.Table.from_pandas(xyz, preserve_index=True)
+        if writer is None:
+            writer = pq.ParquetWriter(out_xyz_path, table.schema, compression="gzip")
+        tables.append(table.cast(writer.schema))
+        rows += table.num_rows
+        if rows >= row_group_rows:
+            writer.write_table(pa.concat_tables(tables), row_group_size=rows)
+            tables = []
+            rows = 0
+
+    if tables:
+        writer.write_table(pa.concat_tables(tables), row_group_size=max(rows, 1))
+    if writer is not None:
+        writer.close()
+    ds = None
+
+    return True
+
+
+def geotiff_to_xyz(in_geotiff, out_xyz_path, stream=False, window_size=None):
+    with span("geotiff_to_xyz") as trace:
+        if stream:
+            geotiff_to_xyz_streaming(in_geotiff, out_xyz_path, window_size)
+        else:
+            ds = gdal.Open(in_geotiff, gdal.GA_ReadOnly)
+            band = ds.GetRasterBand(1)
+            nodata = band.GetNoDataValue()
+
+            xyz = window_to_xyz(band.ReadAsArray(), ds.GetGeoTransform(), nodata, 0, 0, ds.RasterXSize)
+            xyz.to_parquet(out_xyz_path, compression="gzip")
+            ds = None
+        trace["bytes"] = file_size(out_xyz_path)
+
+    return True
+
+
+def band_min_max(band, ds, window_size=None, nodata=None):
+    # pass 1: global min / max block by block, NaN (and nodata if given) ignored
+    vmin = np.inf
+    vmax = -np.inf
+    for x_off, y_off, x_size, y_size in iter_windows(ds, window_size):
+        array = band.ReadAsArray(x_off, y_off, x_size, y_size).astype(np.float64)
+        valid = ~np.isnan(array)
+        if nodata is not None:
+            valid &= array != nodata
+        if valid.any():
+            vmin = min(vmin, array[valid].min())
+            vmax = max(vmax, array[valid].max())
+    return vmin, vmax
+
+
+def band_percentiles(band, ds, vmin, vmax, percentiles, window_size=None, nodata=None, bins=65536):
+    # streaming histogram sketch between min and max, interpolated inside the bin,
+    # accurate to (max - min) / bins
+    if not vmin <= vmax:
+        # band_min_max found no valid pixel
+        raise ValueError("band has no valid pixels, percentiles are undefined")
+    if vmin == vmax:
+        return [vmin] * len(percentiles)
+
+    edges = np.linspace(vmin, vmax, bins + 1)
+    counts = np.zeros(bins, dtype=np.int64)
+    for x_off, y_off, x_size, y_size in iter_windows(ds, window_size):
+        array = band.ReadAsArray(x_off, y_off, x_size, y_size).astype(np.float64)
+        valid = ~np.isnan(array)
+        if nodata is not None:
+            valid &= array != nodata
+        counts += np.histogram(array[valid], bins=edges)[0]
+    return histogram_percentiles(counts, edges, percentiles)
+
+
+def histogram_percentiles(counts, edges, percentiles):
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    if total == 0:
+        raise ValueError("band has no valid pixels, percentiles are undefined")
+    values = []
+    for p in percentiles:
+        target = p / 100.0 * total
+        i = min(int(np.searchsorted(cumulative, target)), len(counts) - 1)
+        before = cumulative[i - 1] if i > 0 else 0
+        fraction = (target - before) / counts[i] if counts[i] else 0.0
+        values.append(float(edges[i] + fraction * (edges[i + 1] - edges[i])))
+    return values
+
+
+def minmax_normalise(in_path, out_path, window_size=None, nodata=None, percentiles=None, block_size=512):
+    # two-pass, block-streaming equivalent of minmax_scale(array.flatten()) written as a tiled GeoTIFF
+    ds = gdal.Open(in_path, gdal.GA_ReadOnly)
+    band = ds.GetRasterBand(1)
+
+    vmin, vmax = band_min_max(band, ds, window_size, nodata)
+    if percentiles is not None:
+        vmin, vmax = band_percentiles(band, ds, vmin, vmax, percentiles, window_size, nodata)
+    scale = vmax - vmin
+    if scale == 0:
+        # same as sklearn for a constant input
+        scale = 1.0
+
+    driver = gdal.GetDriverByName('GTiff')
+    out = driver.Create(out_path, ds.RasterXSize, ds.RasterYSize, 1, gdal.GDT_Float32,
+                        ['COMPRESS=LZW', 'TILED=YES', f'BLOCKXSIZE={block_size}', f'BLOCKYSIZE={block_size}',
+                         'BIGTIFF=IF_SAFER'])
+    out.SetGeoTransform(ds.GetGeoTransform())
+    out.SetProjection(ds.GetProjection())
+    out_band = out.GetRasterBand(1)
+
+    # pass 2: scale and write block by block
+    for x_off, y_off, x_size, y_size in iter_windows(ds, window_size):
+        array = band.ReadAsArray(x_off, y_off, x_size, y_size).astype(np.float64)
+        scaled = (array - vmin) / scale
+        if percentiles is not None:
+            scaled = np.clip(scaled, 0, 1)
+        if nodata is not None:
+            scaled[array == nodata] = np.nan
+        out_band.WriteArray(scaled.astype(np.float32), x_off, y_off)
+
+    if nodata is not None:
+        out_band.SetNoDataValue(np.nan)
+    out.FlushCache()
+    out = None
+    ds = None
+
+    return vmin, vmax
+
+
+def cog_options(data_type, block_size=512, compress="DEFLATE"):
+    # internally tiled, overviews built by the COG driver, predictor matched to the data type;
+    # the COG driver takes predictor names, not the GTiff numbers 2 / 3
+    floating = data_type in (gdal.GDT_Float32, gdal.GDT_Float64)
+    predictor = "FLOATING_POINT" if floating else "STANDARD"
+    return [f'COMPRESS={compress}', f'PREDICTOR={predictor}', f'BLOCKSIZE={block_size}',
+            'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER', 'NUM_THREADS=ALL_CPUS']
+
+
+def to_cog(in_path, out_path=None, block_size=512, compress="DEFLATE"):
+    # out_path None rewrites in_path in place through a temporary file
+    ds = gdal.Open(in_path, gdal.GA_ReadOnly)
+    data_type = ds.GetRasterBand(1).DataType
+    target = out_path or f"{in_path}.cog.tmp"
+    gdal.Translate(target, ds, format="COG", creationOptions=cog_options(data_type, block_size, compress))
+    ds = None
+    if out_path is None:
+        os.replace(target, in_path)
+    return out_path or in_path
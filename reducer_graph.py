@@ -0,0 +1,73 @@
+import ee
+
+
+# names accepted for temporal and spatial reducers, looked up on ee.Reducer at call time
+# so a backend switched in with ee_backend.use_backend() after import is the one used
+REDUCERS = ("mean", "median", "sum", "min", "max", "count", "stdDev", "variance")
+DEFAULT_SPATIAL_REDUCERS = ("mean", "stdDev", "variance", "sum")
+
+
+def as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def make_reducer(name):
+    return getattr(ee.Reducer, name)()
+
+
+def combine_reducers(names):
+    # one combined reducer with shared inputs, so several statistics cost a single pass
+    names = list(dict.fromkeys(names))
+    unknown = [name for name in names if name not in REDUCERS]
+    if unknown or not names:
+        raise ValueError(f"unknown reducers {unknown}, expected some of {sorted(REDUCERS)}")
+    reducer = make_reducer(names[0])
+    for name in names[1:]:
+        reducer = reducer.combine(reducer2=make_reducer(name), sharedInputs=True)
+    return reducer
+
+
+class PanelRequest:
+    def __init__(self, collection, bands, datestart, intervalUnit="month", timeWindowLength=1,
+                 temporal_reducers=("median",), spatial_reducers=DEFAULT_SPATIAL_REDUCERS, scale=None):
+
+        # declarative description of a panel; compile() turns it into the EE graph
+        self.collection = collection
+        self.bands = as_list(bands)
+        self.datestart = datestart
+        self.intervalUnit = intervalUnit
+        self.timeWindowLength = timeWindowLength
+        self.temporal_reducers = list(dict.fromkeys(as_list(temporal_reducers)))
+        self.spatial_reducers = list(dict.fromkeys(as_list(spatial_reducers)))
+        self.scale = scale
+
+        # shared sub-expressions, built once and referenced by every interval of every chunk
+        self.dataset = ee.ImageCollection(collection).select(self.bands)
+        self.projection = self.dataset.first().projection()
+        self.temporal_reducer = combine_reducers(self.temporal_reducers)
+        self.spatial_reducer = combine_reducers(self.spatial_reducers)
+
+    def compile(self, area, offsets):
+        startDate = ee.Date(self.datestart)
+        intervalUnit = self.intervalUnit
+        interval = self.timeWindowLength
+
+        def a(i):
+            startRangeL = startDate.advance(i, intervalUnit)
+            endRangeL = startRangeL.advance(interval, intervalUnit)
+            # every requested temporal statistic in one reduce of the window
+            temporalStat = self.dataset.filterDate(startRangeL, endRangeL).reduce(self.temporal_reducer)
+
+            statsL = temporalStat.reduceRegions(
+                collection=area,
+                reducer=self.spatial_reducer,
+                scale=self.scale,
+                crs=self.projection
+            )
+
+            def b(feature):
+                return feature.set({'composite_start': startRangeL.format('YYYYMM'), 'interval_offset': i})
+
+            return statsL.map(b)
+
+        return ee.FeatureCollection(ee.List(offsets).map(a)).flatten()
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("osgeo")
+
+from shapely.geometry import Polygon, box
+from shapely.ops import unary_union
+
+from auto_tiler import MAX_GRID_DIMENSION, estimate_request_bytes, plan_tiles
+
+
+def test_small_region_is_a_single_tile():
+    bounds = (10, 40, 11, 41)
+    assert plan_tiles(bounds, None, 0.01) == [bounds]
+
+
+def test_large_region_is_split_under_the_request_limits():
+    bounds = (0, 0, 10, 10)
+    max_bytes = 1024 * 1024
+    tiles = plan_tiles(bounds, None, 0.001, n_bands=2, max_bytes=max_bytes)
+
+    assert len(tiles) > 1
+    for tile in tiles:
+        width, height, size = estimate_request_bytes(tile, 0.001, 2, 4)
+        assert size <= max_bytes
+        assert width <= MAX_GRID_DIMENSION and height <= MAX_GRID_DIMENSION
+    # the tiles cover the bounds exactly, without overlaps
+    assert sum(box(*tile).area for tile in tiles) == pytest.approx(100)
+    assert unary_union([box(*tile) for tile in tiles]).equals(box(*bounds))
+
+
+def test_grid_dimension_limit_splits_cheap_requests():
+    tiles = plan_tiles((0, 0, 1, 1), None, 1 / 30000, bytes_per_pixel=1, max_bytes=10 ** 12)
+    assert len(tiles) == 16
+
+
+def test_tiles_outside_the_geometry_are_dropped():
+    bounds = (0, 0, 10, 10)
+    triangle = Polygon([(0, 0), (2, 0), (0, 2)])
+    tiles = plan_tiles(bounds, triangle, 0.001, max_bytes=1024 * 1024)
+    everything = plan_tiles(bounds, None, 0.001, max_bytes=1024 * 1024)
+
+    assert 0 < len(tiles) < len(everything)
+    assert all(box(*tile).intersects(triangle) for tile in tiles)
+    assert unary_union([box(*tile) for tile in tiles]).contains(triangle)
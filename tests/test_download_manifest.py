@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+from download_manifest import DownloadManifest, file_sha256, validate_geotiff
+
+
+BBOX = (0, 0, 5, 5)
+START = "2012-01-01"
+END = "2012-04-01"
+
+
+def write_tiff(path):
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), 4, 4, 1, gdal.GDT_UInt16)
+    ds.GetRasterBand(1).WriteArray(np.arange(16, dtype=np.uint16).reshape(4, 4))
+    ds = None
+    return str(path)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = DownloadManifest(str(tmp_path / "state" / "manifest.sqlite"))
+    yield manifest
+    manifest.close()
+
+
+def error_of(manifest, key):
+    return manifest._conn.execute("SELECT error, attempts FROM tiles WHERE key = ?", (key,)).fetchone()
+
+
+def test_validate_geotiff_rejects_error_bodies(tmp_path):
+    (tmp_path / "error.tif").write_text('{"error": {"message": "User memory limit exceeded."}}')
+    (tmp_path / "empty.tif").write_bytes(b"")
+
+    assert validate_geotiff(write_tiff(tmp_path / "ok.tif")) == (True, "")
+    assert validate_geotiff(str(tmp_path / "error.tif")) == (False, "not a TIFF")
+    assert validate_geotiff(str(tmp_path / "empty.tif")) == (False, "empty file")
+    assert validate_geotiff(str(tmp_path / "missing.tif")) == (False, "empty file")
+
+
+def test_new_tile_has_no_status(manifest, tmp_path):
+    key = manifest.key(BBOX, START, END)
+    assert key == "0_0_5_5_2012-01-01_2012-04-01"
+    assert manifest.status(key) is None
+    assert not manifest.is_done(key, str(tmp_path / "tile.tif"))
+
+
+def test_failed_then_committed(manifest, tmp_path):
+    key = manifest.key(BBOX, START, END)
+    path = str(tmp_path / "tile.tif")
+
+    manifest.mark_failed(key, BBOX, START, END, path, RuntimeError("Service unavailable"))
+    assert manifest.status(key) == "failed"
+    assert error_of(manifest, key) == ("Service unavailable", 1)
+
+    tmp_file = write_tiff(tmp_path / "tile.tif.part")
+    sha = file_sha256(tmp_file)
+    assert manifest.commit_file(key, BBOX, START, END, tmp_file, path)
+
+    assert manifest.status(key) == "done"
+    assert manifest.is_done(key, path)
+    assert not os.path.exists(tmp_file)
+    assert error_of(manifest, key) == (None, 2)
+    row = manifest._conn.execute("SELECT bytes, sha256 FROM tiles WHERE key = ?", (key,)).fetchone()
+    assert row == (os.path.getsize(path), sha)
+    assert manifest.summary() == {"done": {"tiles": 1, "bytes": os.path.getsize(path)}}
+
+
+def test_invalid_download_is_not_renamed_into_place(manifest, tmp_path):
+    key = manifest.key(BBOX, START, END)
+    path = str(tmp_path / "tile.tif")
+    tmp_file = tmp_path / "tile.tif.part"
+    tmp_file.write_text("<html>Too Many Requests</html>")
+
+    assert not manifest.commit_file(key, BBOX, START, END, str(tmp_file), path)
+
+    assert manifest.status(key) == "failed"
+    assert error_of(manifest, key)[0] == "not a TIFF"
+    assert not os.path.exists(tmp_file)
+    assert not os.path.exists(path)
+
+
+def test_done_tile_whose_file_is_gone_is_not_done(manifest, tmp_path):
+    key = manifest.key(BBOX, START, END)
+    path = str(tmp_path / "tile.tif")
+    manifest.commit_file(key, BBOX, START, END, write_tiff(tmp_path / "tile.tif.part"), path)
+
+    os.remove(path)
+    assert manifest.status(key) == "done"
+    assert not manifest.is_done(key, path)
+
+
+def test_adopt_existing_keeps_valid_files_and_removes_broken_ones(manifest, tmp_path):
+    good = manifest.key(BBOX, START, END)
+    bad = manifest.key((5, 0, 10, 5), START, END)
+    good_path = write_tiff(tmp_path / "good.tif")
+    bad_path = tmp_path / "bad.tif"
+    bad_path.write_bytes(b"II*\x00truncated")
+
+    assert manifest.adopt_existing(good, BBOX, START, END, good_path)
+    assert not manifest.adopt_existing(bad, (5, 0, 10, 5), START, END, str(bad_path))
+
+    assert manifest.is_done(good, good_path)
+    assert manifest.status(bad) is None
+    assert not os.path.exists(bad_path)
+
+
+def test_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    manifest = DownloadManifest(path)
+    key = manifest.key(BBOX, START, END)
+    manifest.mark_failed(key, BBOX, START, END, str(tmp_path / "tile.tif"), "boom")
+    manifest.close()
+
+    manifest = DownloadManifest(path)
+    assert manifest.status(key) == "failed"
+    manifest.close()
@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("geopandas")
+
+from get_gee_PANELDATA import ZsGEE, count_intervals, features_to_frame
+
+
+def make_panel(**attributes):
+    panel = ZsGEE()
+    panel.datestart = "2000-01-01"
+    panel.intervalUnit = "month"
+    panel.timeWindowLength = 1
+    panel.intervalCount = 24
+    for name, value in attributes.items():
+        setattr(panel, name, value)
+    return panel
+
+
+@pytest.mark.parametrize("start, end, unit, expected", [
+    ("2000-01-01", "2000-04-01", "month", 3),
+    ("2000-01-15", "2000-04-01", "month", 3),
+    ("2000-01-01", "2000-01-01", "month", 0),
+    ("2000-01-01", "2000-01-08", "day", 7),
+    ("2000-01-01", "2003-06-01", "year", 4),
+])
+def test_count_intervals(start, end, unit, expected):
+    assert count_intervals(start, end, unit) == expected
+
+
+def test_interval_offsets_from_count_or_date_range():
+    assert make_panel(intervalCount=6, timeWindowLength=2).get_interval_offsets() == [0, 2, 4]
+    assert make_panel(dateend="2000-07-01", timeWindowLength=3).get_interval_offsets() == [0, 3]
+
+
+def test_plan_chunks_groups_windows_under_the_budget():
+    panel = make_panel(element_budget=5000, chunk_intervals=12)
+    offsets = list(range(24))
+
+    chunks = panel.plan_chunks(100, offsets)
+
+    assert chunks == [(offsets[:12], (0, 100)), (offsets[12:], (0, 100))]
+
+
+def test_plan_chunks_budget_limits_the_windows_per_chunk():
+    panel = make_panel(element_budget=1000, chunk_intervals=12)
+
+    chunks = panel.plan_chunks(300, list(range(10)))
+
+    assert [len(window) for window, features in chunks] == [3, 3, 3, 1]
+    assert all(len(window) * (end - start) <= 1000 for window, (start, end) in chunks)
+
+
+def test_plan_chunks_splits_features_and_keeps_time_major_order():
+    panel = make_panel(element_budget=5000, chunk_intervals=12)
+
+    chunks = panel.plan_chunks(8000, [0, 1])
+
+    assert chunks == [([0], (0, 5000)), ([0], (5000, 8000)), ([1], (0, 5000)), ([1], (5000, 8000))]
+
+
+def test_plan_chunks_defaults_to_all_intervals():
+    panel = make_panel(intervalCount=3)
+    assert panel.plan_chunks(10) == [([0, 1, 2], (0, 10))]
+
+
+def feature(id, **properties):
+    return {"type": "Feature", "id": id, "geometry": None, "properties": properties}
+
+
+def test_features_to_frame_types_the_panel_columns():
+    df = features_to_frame({"features": [
+        feature("0_0", GID_1="ITA.1_1", mean=0.5, composite_start="200001", interval_offset=0),
+        feature("0_1", GID_1="ITA.2_1", composite_start="200001", interval_offset=0),
+    ]})
+
+    assert list(df["system:index"]) == ["0_0", "0_1"]
+    assert df["GID_1"].dtype == "category"
+    assert str(df["composite_start"].dtype) == "int32"
+    # a property missing on one feature is a null in that row only
+    assert df["mean"].isna().tolist() == [False, True]
+
+
+def test_features_to_frame_without_features_keeps_the_panel_columns():
+    df = features_to_frame({"features": []})
+
+    assert len(df) == 0
+    assert {"system:index", "composite_start", "interval_offset"} <= set(df.columns)
+    assert list(df.groupby("interval_offset")) == []
+
+
+def test_features_to_frame_mixed_types_fall_back_to_strings():
+    df = features_to_frame({"features": [
+        feature("0", code=1.5, composite_start="200001", interval_offset=0),
+        feature("1", code="x", composite_start="200001", interval_offset=0),
+        feature("2", code=None, composite_start="200001", interval_offset=0),
+    ]})
+
+    assert df["code"].tolist()[:2] == ["1.5", "x"]
+    assert df["code"].isna().tolist() == [False, False, True]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+pytest.importorskip("rasterio")
+
+from local_zonal_stats import grouped_stats
+
+
+def masks(indices, zones, weights):
+    return {"indices": np.array(indices, dtype=np.int64), "zones": np.array(zones, dtype=np.int64),
+            "weights": np.array(weights, dtype=np.float32)}
+
+
+def test_weighted_stats_per_zone():
+    values = np.array([[1.0, 3.0, 10.0], [20.0, 7.0, 7.0]])
+    # zone 0: two full pixels, zone 1: half of one pixel and all of another, zone 2: nothing
+    result = grouped_stats(values, masks([0, 1, 2, 3], [0, 0, 1, 1], [1, 1, 0.5, 1]), 3)
+
+    weights = np.array([0.5, 1.0])
+    zone_1 = np.array([10.0, 20.0])
+    mean_1 = np.average(zone_1, weights=weights)
+    np.testing.assert_allclose(result["mean"][:2], [2.0, mean_1])
+    np.testing.assert_allclose(result["sum"][:2], [4.0, 25.0])
+    np.testing.assert_allclose(result["variance"][:2], [1.0, np.average((zone_1 - mean_1) ** 2, weights=weights)])
+    np.testing.assert_allclose(result["stdDev"], np.sqrt(result["variance"]))
+    assert np.isnan(result["mean"][2]) and np.isnan(result["sum"][2])
+
+
+def test_nan_and_nodata_pixels_are_skipped():
+    values = np.array([[np.nan, -9999.0, 4.0, 6.0]])
+    result = grouped_stats(values, masks([0, 1, 2, 3], [0, 0, 0, 1], [1, 1, 1, 1]), 2, nodata=-9999)
+
+    np.testing.assert_allclose(result["mean"], [4.0, 6.0])
+    np.testing.assert_allclose(result["sum"], [4.0, 6.0])
+    np.testing.assert_allclose(result["variance"], [0.0, 0.0])
+
+
+def test_integer_bands_and_overlapping_zones():
+    # a pixel shared by two zones counts in both, with each zone's coverage
+    values = np.array([[2, 4]], dtype=np.uint16)
+    result = grouped_stats(values, masks([0, 1, 1], [0, 0, 1], [1, 0.25, 0.75]), 2)
+
+    np.testing.assert_allclose(result["mean"], [(2 + 0.25 * 4) / 1.25, 4.0])
+    np.testing.assert_allclose(result["sum"], [3.0, 3.0])
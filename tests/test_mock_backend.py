@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("ee")
+pytest.importorskip("geopandas")
+pytest.importorskip("osgeo")
+pytest.importorskip("rasterio")
+
+import collection_metadata
+import ee_backend
+import get_gee_PANELDATA
+
+
+@pytest.fixture
+def mock_backend(tmp_path, monkeypatch):
+    # switched only after get_gee_PANELDATA (and reducer_graph) bound the real ee
+    monkeypatch.setattr(collection_metadata, "CACHE_DIR", str(tmp_path / "collections"))
+    monkeypatch.setattr(collection_metadata, "_memory", {})
+    yield ee_backend.use_backend("mock")
+    ee_backend.use_backend("earthengine")
+
+
+def test_get_dataframe_after_switching_to_mock(mock_backend, tmp_path):
+    panel = get_gee_PANELDATA.ZsGEE()
+    panel.intervalCount = 2
+    panel.timeWindowLength = 1
+    panel.intervalUnit = "month"
+    panel.datestart = "2000-03-01"
+    panel.satellite = "MODIS/061/MOD13A2"
+    panel.bands = "NDVI"
+    panel.temporal_reducer = "median"
+    panel.GadmGID = "LUX"
+    panel.cache_dir = str(tmp_path / "panel_cache")
+
+    df = panel.get_dataframe()
+
+    regions = len(get_gee_PANELDATA.getAreaFrame("LUX"))
+    assert len(df) == 2 * regions
+    assert sorted(df["composite_start"].unique()) == [200003, 200004]
+    for name in panel.spatial_reducers:
+        assert name in df.columns
+    assert df["mean"].notna().all()
+    assert mock_backend.STATS.calls.get("getInfo", 0) > 0
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from panel_cache import PanelCache, request_hash
+
+
+def frame(value):
+    return pd.DataFrame({"GID_1": ["ITA.1_1", "ITA.2_1"], "mean": [value, value + 1]})
+
+
+def test_request_hash_is_canonical():
+    request = {"satellite": "MODIS/061/MOD13A2", "bands": ["NDVI"], "intervalUnit": "month"}
+    assert request_hash(request) == request_hash(dict(reversed(list(request.items()))))
+    assert request_hash(request) != request_hash(dict(request, bands=["EVI"]))
+
+
+def test_write_then_read_round_trip(tmp_path):
+    cache = PanelCache(str(tmp_path))
+    cache.write("key", "2000-03-01", frame(1.0), request={"satellite": "x"})
+
+    pd.testing.assert_frame_equal(cache.read("key", "2000-03-01"), frame(1.0))
+    assert cache.read("key", "2000-04-01") is None
+    assert os.path.exists(tmp_path / "key" / "request.json")
+    assert not [name for name in os.listdir(tmp_path / "key") if name.endswith(".tmp")]
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = PanelCache(str(tmp_path), ttl=60)
+    cache.write("key", "2000-03-01", frame(1.0))
+    path = cache.entry_path("key", "2000-03-01")
+
+    assert cache.read("key", "2000-03-01") is not None
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert cache.read("key", "2000-03-01") is None
+    # ttl None never expires
+    assert PanelCache(str(tmp_path), ttl=None).read("key", "2000-03-01") is not None
+
+
+def test_only_complete_intervals_with_data_are_cached(tmp_path):
+    pytest.importorskip("ee")
+    pytest.importorskip("geopandas")
+    from get_gee_PANELDATA import ZsGEE
+
+    # two finished months and the current one
+    start = (pd.Timestamp.today().normalize() - pd.DateOffset(months=2)).replace(day=1)
+    panel = ZsGEE()
+    panel.datestart = start.strftime("%Y-%m-%d")
+    panel.intervalUnit = "month"
+    panel.timeWindowLength = 1
+    panel.intervalCount = 3
+    panel.satellite = "MODIS/061/MOD13A2"
+    panel.bands = "NDVI"
+    panel.GadmGID = "ITA"
+    panel.cache_dir = str(tmp_path)
+
+    computed = []
+
+    def compute_dataframe(offsets):
+        computed.append(list(offsets))
+        frames = []
+        for offset in offsets:
+            df = frame(float(offset))
+            if offset == 1:
+                # a window without images yet
+                df["mean"] = float("nan")
+            df["interval_offset"] = offset
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    panel.compute_dataframe = compute_dataframe
+
+    assert len(panel.get_dataframe()) == 6
+    cache = PanelCache(str(tmp_path))
+    key = request_hash(panel.get_request())
+    assert cache.read(key, panel.get_interval_start(0)) is not None
+    assert cache.read(key, panel.get_interval_start(1)) is None
+    assert cache.read(key, panel.get_interval_start(2)) is None
+
+    panel.get_dataframe()
+    assert computed == [[0, 1, 2], [1, 2]]
@@ -0,0 +1,47 @@
+import os
+
+import pandas as pd
+
+import panel_store
+
+
+def frame(value):
+    return pd.DataFrame({"GID_1": ["ITA.1_1", "ITA.2_1"], "mean": [value, value + 1],
+                         "composite_start": [200001, 200001]})
+
+
+def test_empty_store_has_no_intervals(tmp_path):
+    assert panel_store.list_intervals(str(tmp_path)) == []
+    assert panel_store.last_interval_start(str(tmp_path)) is None
+
+
+def test_append_intervals_and_read_back(tmp_path):
+    store = str(tmp_path / "store")
+    # written out of order, read back by interval
+    panel_store.write_interval(store, "2000-02-01", frame(2.0))
+    panel_store.write_interval(store, "2000-01-01", frame(1.0))
+
+    assert panel_store.list_intervals(store) == [pd.Timestamp("2000-01-01"), pd.Timestamp("2000-02-01")]
+    assert panel_store.last_interval_start(store) == pd.Timestamp("2000-02-01")
+
+    df = panel_store.read_store(store)
+    assert df["interval_start"].tolist() == [pd.Timestamp("2000-01-01")] * 2 + [pd.Timestamp("2000-02-01")] * 2
+    assert df["mean"].tolist() == [1.0, 2.0, 2.0, 3.0]
+    assert not [name for name in os.listdir(store) if name.startswith(".tmp-")]
+
+
+def test_rewriting_an_interval_replaces_it(tmp_path):
+    store = str(tmp_path / "store")
+    panel_store.write_interval(store, "2000-01-01", frame(1.0))
+    panel_store.write_interval(store, "2000-01-01", frame(5.0))
+
+    df = panel_store.read_store(store)
+    assert df["mean"].tolist() == [5.0, 6.0]
+
+
+def test_half_written_partitions_are_ignored(tmp_path):
+    store = str(tmp_path / "store")
+    panel_store.write_interval(store, "2000-01-01", frame(1.0))
+    os.makedirs(panel_store.partition_dir(store, "2000-02-01"))
+
+    assert panel_store.last_interval_start(store) == pd.Timestamp("2000-01-01")
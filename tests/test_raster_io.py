@@ -0,0 +1,155 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+import pyarrow.parquet as pq
+
+from raster_io import (XYZ_NODATA, band_percentiles, geotiff_to_xyz, histogram_percentiles,
+                       minmax_normalise, npy_to_array, window_to_xyz)
+
+
+GEO_T = (10.0, 0.25, 0.0, 50.0, 0.0, -0.25)
+
+
+def write_tiff(path, array, nodata=None, geo_t=GEO_T):
+    data_type = gdal.GDT_Float32 if np.issubdtype(array.dtype, np.floating) else gdal.GDT_Int16
+    ds = gdal.GetDriverByName("GTiff").Create(str(path), array.shape[1], array.shape[0], 1, data_type)
+    ds.SetGeoTransform(geo_t)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(array)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    ds = None
+    return str(path)
+
+
+def sample_array():
+    array = (np.arange(7 * 9, dtype=np.float32).reshape(7, 9) * 0.37 + 0.001).astype(np.float32)
+    array[0, 0] = np.nan
+    array[1, 2] = -1
+    array[3, 4] = XYZ_NODATA
+    array[6, 8] = np.nan
+    return array
+
+
+def xyz_driver_reference(tif_path, csv_path):
+    # the CSV round trip geotiff_to_xyz used before the array path
+    ds = gdal.Open(tif_path, gdal.GA_ReadOnly)
+    nodata = ds.GetRasterBand(1).GetNoDataValue()
+    gdal.GetDriverByName("XYZ").CreateCopy(str(csv_path), ds)
+    ds = None
+    xyz = pd.read_csv(csv_path, sep=" ", names=["lon", "lat", "value"], header=None)
+    xyz["lon"] = xyz["lon"].round(2)
+    xyz["lat"] = xyz["lat"].round(2)
+    xyz["value"] = pd.to_numeric(xyz["value"], errors="coerce").round(4)
+    xyz = xyz.dropna()
+    xyz = xyz.loc[~(xyz.value == nodata)]
+    xyz = xyz.loc[~(xyz.value == XYZ_NODATA)]
+    return xyz[["lat", "lon", "value"]]
+
+
+def test_window_to_xyz_matches_the_xyz_driver(tmp_path):
+    array = sample_array()
+    tif_path = write_tiff(tmp_path / "in.tif", array, nodata=-1)
+
+    expected = xyz_driver_reference(tif_path, tmp_path / "in.csv")
+    xyz = window_to_xyz(array, GEO_T, -1, 0, 0, array.shape[1])
+
+    assert len(xyz) == 7 * 9 - 4
+    pd.testing.assert_frame_equal(xyz, expected, check_dtype=False, check_index_type=False)
+
+
+def test_windows_reassemble_the_whole_raster():
+    array = sample_array()
+    whole = window_to_xyz(array, GEO_T, -1, 0, 0, array.shape[1])
+    parts = [window_to_xyz(array[y:y + 3, x:x + 4], GEO_T, -1, x, y, array.shape[1])
+             for y in range(0, 7, 3) for x in range(0, 9, 4)]
+    pd.testing.assert_frame_equal(pd.concat(parts).sort_index(), whole)
+
+
+def test_streaming_export_matches_the_in_memory_export(tmp_path):
+    tif_path = write_tiff(tmp_path / "in.tif", sample_array(), nodata=-1)
+    geotiff_to_xyz(tif_path, tmp_path / "memory.parquet")
+    geotiff_to_xyz(tif_path, tmp_path / "stream.parquet", stream=True, window_size=(4, 2))
+
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "stream.parquet"),
+                                  pd.read_parquet(tmp_path / "memory.parquet"))
+    # small windows are still grouped into one row group
+    assert pq.ParquetFile(tmp_path / "stream.parquet").metadata.num_row_groups == 1
+
+
+def npy_bytes(array, version=None):
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, array, version=version)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("version", [(1, 0), (2, 0)])
+def test_npy_to_array_is_a_view_on_the_payload(version):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    buffer = npy_bytes(array, version)
+
+    out = npy_to_array(buffer)
+
+    np.testing.assert_array_equal(out, array)
+    assert not out.flags.writeable
+    assert np.shares_memory(out, np.frombuffer(buffer, dtype=np.uint8))
+
+
+def test_npy_to_array_keeps_fortran_order_and_structured_bands():
+    fortran = np.asfortranarray(np.arange(6, dtype=np.int16).reshape(2, 3))
+    np.testing.assert_array_equal(npy_to_array(npy_bytes(fortran)), fortran)
+
+    # computePixels returns one named field per band
+    bands = np.zeros((2, 2), dtype=[("avg_rad", np.float32), ("cf_cvg", np.uint16)])
+    bands["avg_rad"] = [[1.5, 2.5], [3.5, 4.5]]
+    bands["cf_cvg"] = 7
+    out = npy_to_array(npy_bytes(bands))
+    assert out.dtype.names == ("avg_rad", "cf_cvg")
+    np.testing.assert_array_equal(out["avg_rad"], bands["avg_rad"])
+    np.testing.assert_array_equal(out["cf_cvg"], bands["cf_cvg"])
+
+
+def test_histogram_percentiles_span_min_to_max():
+    edges = np.linspace(0, 10, 11)
+    counts = np.ones(10, dtype=np.int64)
+    assert histogram_percentiles(counts, edges, [0, 25, 50, 100]) == pytest.approx([0, 2.5, 5, 10])
+
+
+def test_minmax_normalise_scales_to_unit_range(tmp_path):
+    array = np.arange(30, dtype=np.float32).reshape(5, 6) * 2 + 10
+    array[2, 3] = -1
+    in_path = write_tiff(tmp_path / "in.tif", array)
+
+    vmin, vmax = minmax_normalise(in_path, str(tmp_path / "out.tif"), window_size=(4, 2), nodata=-1)
+
+    valid = array != -1
+    assert (vmin, vmax) == (array[valid].min(), array[valid].max())
+    out = gdal.Open(str(tmp_path / "out.tif")).GetRasterBand(1).ReadAsArray()
+    np.testing.assert_allclose(out[valid], (array[valid] - vmin) / (vmax - vmin), rtol=1e-6)
+    assert np.isnan(out[2, 3])
+
+
+def test_percentiles_follow_the_data_within_one_bin(tmp_path):
+    array = np.random.default_rng(0).normal(size=(400, 500)).astype(np.float32)
+    in_path = write_tiff(tmp_path / "in.tif", array)
+    ds = gdal.Open(in_path)
+
+    vmin, vmax = float(array.min()), float(array.max())
+    values = band_percentiles(ds.GetRasterBand(1), ds, vmin, vmax, [0, 2, 50, 98, 100], window_size=(128, 64))
+
+    bin_width = (vmax - vmin) / 65536
+    assert values[0] == pytest.approx(vmin)
+    assert values[-1] == pytest.approx(vmax)
+    np.testing.assert_allclose(values[1:4], np.percentile(array, [2, 50, 98]), atol=2 * bin_width + 1e-3)
+
+
+def test_percentiles_of_an_empty_band_raise(tmp_path):
+    in_path = write_tiff(tmp_path / "in.tif", np.full((4, 4), -1, dtype=np.float32))
+
+    with pytest.raises(ValueError):
+        minmax_normalise(in_path, str(tmp_path / "out.tif"), nodata=-1, percentiles=(2, 98))
@@ -0,0 +1,58 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import ee
+from http_download import download_to_file, make_session
+
+
+_ee_lock = threading.Lock()
+_ee_initialized = False
+
+
+def init_ee(email, keypath):
+    # credentials are set up once per process and shared by every worker thread
+    global _ee_initialized
+    with _ee_lock:
+        if not _ee_initialized:
+            credentials = ee.ServiceAccountCredentials(email, keypath)
+            ee.Initialize(credentials)
+            _ee_initialized = True
+
+
+class TileDownloader:
+    def __init__(self, max_workers=16, max_per_host=8):
+
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+
+        self.session = make_session(pool_maxsize=max_per_host)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+
+    def host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def get(self, url, **kwargs):
+        with self.host_slot(url):
+            return self.session.get(url, **kwargs)
+
+    def download(self, url, out_path, atomic=True):
+        with self.host_slot(url):
+            return download_to_file(url, out_path, session=self.session, atomic=atomic)
+
+    def map(self, fn, jobs):
+        # I/O bound work: threads waiting on the network instead of one process per request
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(fn, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(futures[future][:4], e)
+        return results
@@ -0,0 +1,139 @@
+import atexit
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+# latency histogram buckets in seconds, the last one catches everything
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+# stages that are a round trip to Earth Engine
+RPC_STAGES = ("getInfo", "getDownloadUrl", "computePixels")
+TRACE_FILE = os.environ.get("GEE_TRACE_FILE")
+
+
+class Tracer:
+    def __init__(self, buckets=BUCKETS):
+
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.stages = {}
+
+    def record(self, name, seconds, size=0, error=False):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = {"count": 0, "errors": 0, "seconds": 0.0, "bytes": 0, "buckets": [0] * len(self.buckets)}
+                self.stages[name] = stage
+            stage["count"] += 1
+            stage["errors"] += int(error)
+            stage["seconds"] += seconds
+            stage["bytes"] += size
+            stage["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    @contextmanager
+    def span(self, name):
+        # the caller can set span["bytes"] for transfers and writes
+        span = {"bytes": 0}
+        error = False
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, span["bytes"] or 0, error)
+
+    def traced(self, name=None, size=None):
+        # decorator form of span; size(result) gives the bytes of the call
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name or fn.__name__) as span:
+                    result = fn(*args, **kwargs)
+                    if size is not None:
+                        span["bytes"] = size(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: dict(stage, buckets=list(stage["buckets"])) for name, stage in self.stages.items()}
+        return {
+            "rpcs": {name: stages[name]["count"] for name in RPC_STAGES if name in stages},
+            "buckets": [b if b != math.inf else "+Inf" for b in self.buckets],
+            "stages": stages,
+        }
+
+    def summary(self):
+        snapshot = self.snapshot()
+        return {name: {"count": s["count"], "errors": s["errors"], "seconds": round(s["seconds"], 3), "bytes": s["bytes"]}
+                for name, s in snapshot["stages"].items()}
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def to_openmetrics(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE gee_stage_seconds histogram",
+            "# UNIT gee_stage_seconds seconds",
+            "# HELP gee_stage_seconds Wall time per pipeline stage.",
+        ]
+        for name, stage in snapshot["stages"].items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, stage["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f'gee_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'gee_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+            lines.append(f'gee_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}')
+
+        lines += ["# TYPE gee_stage_bytes counter", "# UNIT gee_stage_bytes bytes",
+                  "# HELP gee_stage_bytes Bytes transferred or written per pipeline stage."]
+        lines += [f'gee_stage_bytes_total{{stage="{name}"}} {stage["bytes"]}'
+                  for name, stage in snapshot["stages"].items()]
+        lines += ["# TYPE gee_stage_errors counter", "# HELP gee_stage_errors Failed calls per pipeline stage."]
+        lines += [f'gee_stage_errors_total{{stage="{name}"}} {stage["errors"]}'
+                  for name, stage in snapshot["stages"].items()]
+        lines += ["# TYPE gee_rpcs counter", "# HELP gee_rpcs Earth Engine round trips."]
+        lines += [f'gee_rpcs_total{{kind="{name}"}} {count}' for name, count in snapshot["rpcs"].items()]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        # .json for the snapshot, anything else in the OpenMetrics text format
+        out_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fd:
+            if path.endswith(".json"):
+                json.dump(self.snapshot(), fd, indent=1)
+            else:
+                fd.write(self.to_openmetrics())
+        os.replace(tmp_path, path)
+        return path
+
+
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
+export = TRACER.export
+summary = TRACER.summary
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+if TRACE_FILE:
+    # e.g. GEE_TRACE_FILE=OUTPUT/trace.prom python nigthlight.py
+    atexit.register(export, TRACE_FILE)
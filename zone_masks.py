@@ -0,0 +1,98 @@
+import hashlib
+import math
+import os
+import shutil
+import numpy as np
+from affine import Affine
+from rasterio.features import rasterize
+
+
+CACHE_DIR = os.environ.get("GEE_MASK_CACHE", os.path.expanduser("~/.cache/gee_demo/masks"))
+SUPERSAMPLE = 4
+MAX_FINE_PIXELS = 64 * 1024 * 1024
+
+
+def mask_key(area, geo_t, shape, supersample=SUPERSAMPLE):
+    # (geometry hash, geotransform, shape): any change in zones or grid gives a new entry
+    sha = hashlib.sha256()
+    for geom in area.geometry:
+        sha.update(geom.wkb if geom is not None else b"")
+    sha.update(repr((tuple(geo_t), tuple(shape), supersample)).encode("utf-8"))
+    return sha.hexdigest()[:32]
+
+
+def zone_coverage(geom, geo_t, shape, supersample=SUPERSAMPLE):
+    # flat pixel indices and the fraction of each pixel covered by geom
+    transform = Affine.from_gdal(*geo_t)
+    minx, miny, maxx, maxy = geom.bounds
+    c0, r0 = ~transform * (minx, maxy)
+    c1, r1 = ~transform * (maxx, miny)
+    col0 = max(int(math.floor(min(c0, c1))), 0)
+    col1 = min(int(math.ceil(max(c0, c1))), shape[1])
+    row0 = max(int(math.floor(min(r0, r1))), 0)
+    row1 = min(int(math.ceil(max(r0, r1))), shape[0])
+    if col1 <= col0 or row1 <= row0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    width = col1 - col0
+    s = supersample
+    # rasterize the window on a supersampled grid, in row strips to bound memory
+    strip = max(1, MAX_FINE_PIXELS // (width * s * s))
+    indices = []
+    weights = []
+    for row in range(row0, row1, strip):
+        height = min(strip, row1 - row)
+        fine_transform = transform * Affine.translation(col0, row) * Affine.scale(1 / s)
+        fine = rasterize([(geom, 1)], out_shape=(height * s, width * s), transform=fine_transform,
+                         fill=0, dtype="uint8")
+        cover = fine.reshape(height, s, width, s).sum(axis=(1, 3)) / (s * s)
+        r, c = np.nonzero(cover)
+        indices.append((r + row).astype(np.int64) * shape[1] + (c + col0))
+        weights.append(cover[r, c].astype(np.float32))
+
+    return np.concatenate(indices), np.concatenate(weights)
+
+
+def build_zone_masks(area, geo_t, shape, supersample=SUPERSAMPLE):
+    indices = []
+    weights = []
+    zones = []
+    for i, geom in enumerate(area.geometry):
+        if geom is None or geom.is_empty:
+            continue
+        idx, w = zone_coverage(geom, geo_t, shape, supersample)
+        indices.append(idx)
+        weights.append(w)
+        zones.append(np.full(len(idx), i, dtype=np.int32))
+
+    if not indices:
+        return {"indices": np.empty(0, np.int64), "weights": np.empty(0, np.float32), "zones": np.empty(0, np.int32)}
+    return {"indices": np.concatenate(indices), "weights": np.concatenate(weights), "zones": np.concatenate(zones)}
+
+
+def get_zone_masks(area, geo_t, shape, supersample=SUPERSAMPLE, cache_dir=None):
+    # sparse masks are built once per grid and memory-mapped from disk afterwards
+    key = mask_key(area, geo_t, shape, supersample)
+    entry_dir = f"{cache_dir or CACHE_DIR}/{key}"
+
+    if not os.path.exists(entry_dir):
+        masks = build_zone_masks(area, geo_t, shape, supersample)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name, array in masks.items():
+            np.save(f"{tmp_dir}/{name}.npy", array)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same masks first
+            shutil.rmtree(tmp_dir)
+
+    return {name: load_array(f"{entry_dir}/{name}.npy") for name in ("indices", "weights", "zones")}
+
+
+def load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        return np.load(path)